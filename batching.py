@@ -0,0 +1,112 @@
+"""
+소켓별 송신 마이크로 배칭 (opt-in)
+
+연결 시 ?batch=<ms> 를 붙인 소켓은 이벤트를 바로 보내지 않고 모아서
+{"type": "batch", "items": [...]} 프레임 하나로 보낸다.
+- 마지막 이벤트 이후 window(ms) 동안 더 안 들어오면 전송
+- 이벤트가 계속 들어와도 첫 이벤트부터 BATCH_MAX_DELAY_MS 가 지나면 전송 (지연 상한)
+- BATCH_MAX_ITEMS 개가 모이면 즉시 전송
+- 모인 이벤트가 하나뿐이면 batch로 감싸지 않고 그대로 전송
+각 이벤트는 원래 프레임(코덱으로 인코딩된 바이트)을 그대로 담으므로 다시 인코딩하지 않음.
+"""
+
+import asyncio
+import os
+from typing import List
+from fastapi import WebSocket
+
+from protocol import Codec
+from serverHelper import _write_frame
+from metrics import Counter
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_MAX_DELAY_MS = int(os.getenv("BATCH_MAX_DELAY_MS", "50"))
+
+batch_frames = Counter("klav_batch_frames_total", "Frames written by batching sockets")
+batch_events = Counter("klav_batch_events_total", "Events delivered through batching sockets")
+
+
+def parse_batch_window(value: str | None) -> float | None:
+    """?batch= 쿼리 값 -> 창 길이(초), 없거나 잘못되면 None (배칭 안 함)"""
+    try:
+        ms = int(value) if value else 0
+    except ValueError:
+        return None
+    if ms <= 0:
+        return None
+    return min(ms, BATCH_MAX_DELAY_MS) / 1000
+
+
+class FrameBatcher:
+    __slots__ = ("ws", "codec", "window", "max_items", "max_delay",
+                 "frames", "_first", "_last", "_timer", "_task", "_closed")
+
+    def __init__(self, ws: WebSocket, codec: Codec, window: float,
+                 max_items: int = BATCH_MAX_ITEMS, max_delay: float = BATCH_MAX_DELAY_MS / 1000):
+        self.ws = ws
+        self.codec = codec
+        self.window = window
+        self.max_items = max(1, max_items)
+        self.max_delay = max(window, max_delay)
+        self.frames: List[bytes] = []
+        self._first = 0.0
+        self._last = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    def push(self, frame: bytes):
+        if self._closed:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.frames.append(frame)
+        self._last = now
+        if len(self.frames) == 1:
+            self._first = now
+        if len(self.frames) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_at(now + self.window, self._on_timer)
+
+    def _deadline(self) -> float:
+        return min(self._last + self.window, self._first + self.max_delay)
+
+    def _on_timer(self):
+        # 이벤트마다 타이머를 다시 걸지 않고, 깨어났을 때 남은 시간만큼 다시 잠
+        self._timer = None
+        if not self.frames:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = self._deadline()
+        if loop.time() < deadline:
+            self._timer = loop.call_at(deadline, self._on_timer)
+        else:
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # 전송 중이면 그 태스크가 끝나고 이어서 보냄 (프레임 순서 유지)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self.frames and not self._closed:
+            frames, self.frames = self.frames[:self.max_items], self.frames[self.max_items:]
+            frame = frames[0] if len(frames) == 1 else self.codec.encode_batch(frames)
+            batch_frames.inc()
+            batch_events.inc(len(frames))
+            try:
+                await _write_frame(self.ws, self.codec, frame)
+            except Exception:
+                # 실패는 _write_frame이 이미 알림 (소켓 정리는 ConnectionManager가)
+                self.close()
+
+    def close(self):
+        self._closed = True
+        self.frames = []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -0,0 +1,114 @@
+"""
+permessage-deflate 설정별 전송 바이트 / 프레임당 CPU 벤치마크
+
+사용법:
+    python bench_compression.py
+    python bench_compression.py --frames 2000
+
+동작:
+    - history(50개), my_rooms(100개 방), 일반 message 이벤트 페이로드를 만들어
+      protocol.JSON 코덱으로 인코딩
+    - ws_compression.ThresholdPerMessageDeflate.encode()로 실제 서버와 같은 경로로 압축
+    - 같은 소켓에 연속으로 보내는 상황(context takeover 효과 포함)을 --frames 만큼 반복
+    - DB / 서버 실행 불필요
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from websockets import frames
+from protocol import JSON
+from ws_compression import ThresholdPerMessageDeflate
+
+NICKS = ["민수", "지영", "철수", "영희", "서버팀", "klav-bot", "하늘", "바다"]
+TEXTS = [
+    "오늘 점심 뭐 먹을까요?", "배포 끝났습니다 확인 부탁드려요", "ㅋㅋㅋㅋ", "회의 10분 뒤에 시작합니다",
+    "로그 확인해보니 타임아웃이 많네요", "좋아요!", "내일 봐요", "PR 리뷰 부탁드립니다 🙏",
+]
+
+def _ts(i: int) -> str:
+    return (datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=i)).isoformat()
+
+def history_payload(rng: random.Random, room_id: str, n: int = 50) -> dict:
+    items = []
+    for i in range(n):
+        nick = rng.choice(NICKS)
+        items.append({
+            "id": 100000 + i, "seq": 5000 + i, "ts": _ts(i), "kind": "msg", "room": room_id,
+            "from": f"user_{NICKS.index(nick)}", "from_nickname": nick, "text": rng.choice(TEXTS),
+        })
+    return {"type": "history", "room": room_id, "items": items}
+
+def my_rooms_payload(rng: random.Random, n: int = 100) -> dict:
+    infos = []
+    for i in range(n):
+        nick = rng.choice(NICKS)
+        infos.append({
+            "id": f"r_{i:08x}", "name": f"{nick}의 대화방 {i}",
+            "last": {"text": rng.choice(TEXTS), "from": f"user_{NICKS.index(nick)}", "kind": "msg", "ts": _ts(i)},
+            "last_read_id": 1000 + i, "unread": rng.randint(0, 30),
+        })
+    return {"type": "my_rooms", "ts": _ts(0), "rooms": [it["id"] for it in infos], "rooms_info": infos}
+
+def message_payload(rng: random.Random, room_id: str, i: int) -> dict:
+    nick = rng.choice(NICKS)
+    return {"type": "message", "ts": _ts(i), "room": room_id, "from": f"user_{NICKS.index(nick)}",
+            "from_nickname": nick, "text": rng.choice(TEXTS), "id": 200000 + i, "seq": 9000 + i}
+
+SETTINGS = [
+    # (이름, window_bits, memLevel, no_context_takeover, min_size)  None = 압축 안 함
+    ("none", None, None, None, None),
+    ("w15 mem8 takeover (uvicorn default)", 15, 8, False, 0),
+    ("w12 mem5 takeover", 12, 5, False, 0),
+    ("w12 mem5 takeover min1024 (default)", 12, 5, False, 1024),
+    ("w12 mem5 no-takeover min1024", 12, 5, True, 1024),
+]
+
+def make_ext(bits, mem, no_takeover, min_size) -> ThresholdPerMessageDeflate:
+    return ThresholdPerMessageDeflate(False, no_takeover, 15, bits, {"memLevel": mem}, min_size=min_size)
+
+def run(payloads: list[bytes], setting) -> tuple[float, float, int]:
+    _, bits, mem, no_takeover, min_size = setting
+    raw = sum(len(p) for p in payloads)
+    if bits is None:
+        return raw, 0.0, 0
+
+    tracemalloc.start()
+    ext = make_ext(bits, mem, no_takeover, min_size)
+    _, idle_mem = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    wire = 0
+    t0 = time.process_time()
+    for p in payloads:
+        frame = ext.encode(frames.Frame(frames.OP_TEXT, p))
+        wire += len(frame.data)
+    cpu = time.process_time() - t0
+    return wire, cpu / len(payloads) * 1e6, idle_mem
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    workloads = {
+        "history(50)": [JSON.encode(history_payload(rng, f"r_{i % 5:08x}")) for i in range(args.frames)],
+        "my_rooms(100)": [JSON.encode(my_rooms_payload(rng)) for _ in range(args.frames)],
+        "message": [JSON.encode(message_payload(rng, "r_00000001", i)) for i in range(args.frames)],
+    }
+
+    for name, payloads in workloads.items():
+        avg = sum(len(p) for p in payloads) / len(payloads)
+        print(f"\n📦 {name}: 평균 {avg:,.0f} bytes/frame, {len(payloads)} frames")
+        print(f"   {'setting':<36}{'bytes/frame':>12}{'ratio':>8}{'CPU µs/frame':>14}{'ctx mem':>10}")
+        raw = sum(len(p) for p in payloads)
+        for setting in SETTINGS:
+            wire, cpu_us, ctx_mem = run(payloads, setting)
+            print(f"   {setting[0]:<36}{wire / len(payloads):>12,.0f}{wire / raw:>8.2f}{cpu_us:>14.1f}"
+                  f"{ctx_mem / 1024:>9.0f}K")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+메시지 검색 지연시간 벤치마크 (pg_trgm GIN 인덱스)
+
+사용법:
+    python bench_search.py                 # 기본 300만 행
+    python bench_search.py --rows 5000000 --keep
+
+동작:
+    - 벤치마크용 사용자/방을 만들고 chat_logs에 generate_series로 대량 삽입
+    - 사용자가 속한 방(1개)과 속하지 않은 방(나머지)에 로그를 나눠 넣어
+      멤버십 필터가 실제로 걸리도록 함
+    - 여러 검색어에 대해 manager.search_messages() 지연시간(p50/p95/p99) 출력
+      3글자 이상은 trigram 인덱스(trgm), 2글자는 방별 최근 SEARCH_SHORT_SCAN개만 훑는 경로(recent)와
+      제한 없이 전체를 훑을 때(full, 인덱스를 못 쓰는 이전 동작)를 함께 출력
+    - --keep 이 없으면 끝난 뒤 벤치마크 데이터 삭제
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from sqlalchemy import text, delete
+from database import init_db, get_db, close_db
+from models import User, Room, RoomMember
+from serverPostgres import manager
+
+BENCH_USER = "__bench_search"
+BENCH_ROOMS = [f"r_bench{i:03d}" for i in range(10)]  # 첫 번째 방만 멤버
+
+WORDS = [
+    "안녕하세요", "오늘", "점심", "회의", "서버", "배포", "버그", "수정", "주말", "커피",
+    "deploy", "server", "lunch", "meeting", "release", "hotfix", "weekend", "coffee",
+]
+
+QUERIES = ["서버", "점심", "안녕하세요", "배포 완료", "hotfix", "존재하지않는검색어"]
+FULL_SCAN = 2**31 - 1  # SEARCH_SHORT_SCAN을 이 값으로 두면 제한 없음
+
+async def seed(rows: int, batch: int = 500_000):
+    print(f"🌱 chat_logs {rows:,}행 삽입 중...")
+    async with get_db() as db:
+        db.add(User(username=BENCH_USER, password="bench", nickname="bench"))
+        for rid in BENCH_ROOMS:
+            db.add(Room(id=rid, name=rid))
+        await db.flush()
+        db.add(RoomMember(room_id=BENCH_ROOMS[0], username=BENCH_USER))
+        await db.commit()
+
+    words = "ARRAY[" + ",".join(f"'{w}'" for w in WORDS) + "]"
+    rooms = "ARRAY[" + ",".join(f"'{r}'" for r in BENCH_ROOMS) + "]"
+    done = 0
+    t0 = time.perf_counter()
+    while done < rows:
+        n = min(batch, rows - done)
+        async with get_db() as db:
+            await db.execute(text(f"""
+                INSERT INTO chat_logs (room_id, seq, ts, kind, from_user, from_nickname, text)
+                SELECT ({rooms})[1 + (g % {len(BENCH_ROOMS)})],
+                       ({rows} - 1 - g) / {len(BENCH_ROOMS)} + 1,
+                       now() - (g || ' seconds')::interval,
+                       'msg', '{BENCH_USER}', 'bench',
+                       ({words})[1 + (random() * {len(WORDS) - 1})::int] || ' ' ||
+                       ({words})[1 + (random() * {len(WORDS) - 1})::int] || ' ' ||
+                       ({words})[1 + (random() * {len(WORDS) - 1})::int] || ' ' || g
+                FROM generate_series(CAST(:start AS integer), CAST(:stop AS integer)) AS g
+            """), {"start": done, "stop": done + n - 1})
+        done += n
+        print(f"   {done:,} / {rows:,} ({time.perf_counter() - t0:.1f}s)")
+
+    async with get_db() as db:
+        # 방별 seq (g가 작을수록 최신) -> rooms.last_seq
+        await db.execute(text("""
+            UPDATE rooms r SET last_seq = m.max_seq
+            FROM (SELECT room_id, max(seq) AS max_seq FROM chat_logs WHERE room_id = ANY(:rooms) GROUP BY room_id) m
+            WHERE r.id = m.room_id
+        """), {"rooms": BENCH_ROOMS})
+        await db.execute(text("ANALYZE chat_logs"))
+    print("✅ 삽입 완료")
+
+async def cleanup():
+    async with get_db() as db:
+        await db.execute(delete(Room).where(Room.id.in_(BENCH_ROOMS)))
+        await db.execute(delete(User).where(User.username == BENCH_USER))
+    print("🗑️  벤치마크 데이터 삭제 완료")
+
+async def bench(repeat: int):
+    print(f"\n{'query':<22}{'mode':<14}{'hits':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    short_scan = manager.SEARCH_SHORT_SCAN
+    for q in QUERIES:
+        if len(q) >= manager.SEARCH_TRGM_MIN_LEN:
+            await bench_query(q, "trgm", repeat)
+            continue
+        await bench_query(q, f"recent {short_scan}", repeat)
+        manager.SEARCH_SHORT_SCAN = FULL_SCAN
+        try:
+            await bench_query(q, "full", repeat)
+        finally:
+            manager.SEARCH_SHORT_SCAN = short_scan
+
+async def bench_query(q: str, mode: str, repeat: int):
+    samples = []
+    hits = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        items, next_cursor = await manager.search_messages(BENCH_USER, q, limit=20)
+        samples.append((time.perf_counter() - t0) * 1000)
+        hits = len(items)
+    # 두 번째 페이지 (커서) 도 한 번 측정
+    if next_cursor:
+        t0 = time.perf_counter()
+        await manager.search_messages(BENCH_USER, q, limit=20, cursor=next_cursor)
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    p = lambda x: samples[min(len(samples) - 1, int(len(samples) * x))]
+    print(f"{q:<22}{mode:<14}{hits:>6}{statistics.median(samples):>10.1f}{p(0.95):>10.1f}{p(0.99):>10.1f}")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help="벤치마크 데이터를 지우지 않음")
+    args = parser.parse_args()
+
+    await init_db()
+    await cleanup()
+    try:
+        await seed(args.rows)
+        await bench(args.repeat)
+    finally:
+        if not args.keep:
+            await cleanup()
+        await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""
+연결별 상태 메모리 벤치마크 (ws.state + 연결별 dict/set  vs  session.Session)
+
+사용법:
+    python bench_sessions.py
+    python bench_sessions.py --conns 100000 --per-user 2 --rooms 20
+
+동작:
+    - starlette WebSocket 객체를 --conns 개 만들고 (실제 소켓/DB 없음)
+    - legacy : ws.state에 codec/username/last_seen/focus/batcher를 두고
+               user_conns / presence_friend_subs / user_rooms 에 등록하던 이전 구조
+    - session: Session 하나를 ws.scope에 두고 user_sessions / user_rooms 에 등록하는 현재 구조
+    - 각각 tracemalloc으로 연결당 바이트와, 전체 세션 순회(fan-out 대상 수집) 시간을 측정
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from collections import defaultdict
+from starlette.websockets import WebSocket
+
+from protocol import JSON
+from serverHelper import SESSION_SCOPE_KEY
+from session import Session
+
+
+async def _noop_receive():
+    return {"type": "websocket.disconnect"}
+
+async def _noop_send(message):
+    pass
+
+def _make_ws(i: int) -> WebSocket:
+    scope = {"type": "websocket", "path": "/ws", "headers": [], "query_string": b"",
+             "client": ("127.0.0.1", 10000 + i % 50000), "state": {}}
+    return WebSocket(scope, _noop_receive, _noop_send)
+
+def _room_sets(users: int, rooms: int) -> dict:
+    return {f"user_{u}": {f"r_{(u + k) % 5000:08x}" for k in range(rooms)} for u in range(users)}
+
+def build_legacy(conns: int, per_user: int, rooms_of: dict):
+    user_conns = defaultdict(set)
+    presence_friend_subs = defaultdict(set)
+    user_rooms = {}
+    for i in range(conns):
+        u = f"user_{i // per_user}"
+        ws = _make_ws(i)
+        ws.state.codec = JSON
+        ws.state.username = u
+        ws.state.last_seen = time.monotonic()
+        ws.state.focus = None
+        ws.state.batcher = None
+        user_conns[u].add(ws)
+        if i % 3 == 0:
+            presence_friend_subs[u].add(ws)
+        if u not in user_rooms:
+            user_rooms[u] = set(rooms_of[u])
+    return user_conns, presence_friend_subs, user_rooms
+
+def build_sessions(conns: int, per_user: int, rooms_of: dict):
+    user_sessions = {}
+    user_rooms = {}
+    for i in range(conns):
+        u = f"user_{i // per_user}"
+        ws = _make_ws(i)
+        if u not in user_rooms:
+            user_rooms[u] = set(rooms_of[u])
+        # 같은 사용자의 세션은 닉네임/방 집합을 공유 (ConnectionManager.accept와 동일)
+        same_user = user_sessions.get(u)
+        nickname = next(iter(same_user)).nickname if same_user else u.upper()
+        session = Session(ws, u, nickname, JSON, user_rooms[u])
+        session.presence_sub = i % 3 == 0
+        ws.scope[SESSION_SCOPE_KEY] = session
+        user_sessions.setdefault(u, set()).add(session)
+    return user_sessions, user_rooms
+
+def measure(build, *args):
+    gc.collect()
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    t0 = time.perf_counter()
+    state = build(*args)
+    elapsed = time.perf_counter() - t0
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return state, used - base, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conns", type=int, default=100_000)
+    parser.add_argument("--per-user", type=int, default=2)
+    parser.add_argument("--rooms", type=int, default=20)
+    args = parser.parse_args()
+
+    users = (args.conns + args.per_user - 1) // args.per_user
+    rooms_of = _room_sets(users, args.rooms)
+    print(f"🔌 {args.conns:,} connections, {users:,} users, {args.rooms} rooms/user")
+
+    legacy, legacy_bytes, legacy_build = measure(build_legacy, args.conns, args.per_user, rooms_of)
+    user_conns = legacy[0]
+    t0 = time.perf_counter()
+    n = sum(1 for conns in user_conns.values() for ws in conns if ws.state.focus is None)
+    legacy_iter = time.perf_counter() - t0
+    del legacy, user_conns
+
+    sessions, session_bytes, session_build = measure(build_sessions, args.conns, args.per_user, rooms_of)
+    user_sessions = sessions[0]
+    t0 = time.perf_counter()
+    m = sum(1 for ss in user_sessions.values() for s in ss if s.focus is None)
+    session_iter = time.perf_counter() - t0
+    assert n == m == args.conns
+
+    print(f"   {'layout':<10}{'total':>12}{'bytes/conn':>12}{'build':>10}{'iterate all':>14}")
+    for name, total, build, it in (("legacy", legacy_bytes, legacy_build, legacy_iter),
+                                   ("session", session_bytes, session_build, session_iter)):
+        print(f"   {name:<10}{total / 1024 / 1024:>10.1f}MB{total / args.conns:>12,.0f}"
+              f"{build * 1000:>8.0f}ms{it * 1000:>12.1f}ms")
+    print("   (방 집합 포함, tracemalloc 계측 중이라 시간은 상대 비교용)")
+
+if __name__ == "__main__":
+    main()
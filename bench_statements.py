@@ -0,0 +1,135 @@
+"""
+자주 실행하는 조회문의 Python 측 CPU 벤치마크 (요청마다 select 생성  vs  queries.py 고정 문장)
+
+사용법:
+    python bench_statements.py
+    python bench_statements.py --repeat 5000 --logs 200
+
+동작:
+    - 벤치마크용 사용자 2명/방 1개/로그 --logs 개를 만들고
+    - legacy : 이전 코드처럼 호출마다 select(User) / select(ChatLog) ... 를 새로 만들어 ORM 엔티티로 조회
+    - cached : queries.py의 문장을 bindparam 값만 바꿔 재사용 (컬럼 조회)
+    - 쿼리별로 --repeat 번 실행해 time.process_time() 기준 호출당 CPU(µs)를 출력
+      (DB 서버 시간은 포함되지 않음, 같은 프로세스의 asyncpg 프로토콜 처리는 포함)
+    - "build" 열은 DB 없이 문장 생성 + 컴파일(캐시 조회)만 한 CPU
+"""
+
+import argparse
+import asyncio
+import time
+from sqlalchemy import select, and_, desc, delete, insert
+from sqlalchemy.dialects import postgresql
+
+import queries
+from database import init_db, get_db, close_db, DB_QUERY_CACHE_SIZE, DB_STATEMENT_CACHE_SIZE
+from models import User, Room, RoomMember, ChatLog, Follow
+
+BENCH_USERS = ["__bench_stmt_a", "__bench_stmt_b"]
+BENCH_ROOM = "r_bench_st"
+
+def legacy_statements(user: str, room: str) -> dict:
+    # 이전 serverPostgres.py 의 조회문 (호출마다 생성)
+    return {
+        "get_user_info": lambda: select(User).where(User.username == user),
+        "rooms_summary": lambda: (
+            select(Room, RoomMember.last_read_id, RoomMember.read_count)
+            .join(RoomMember, Room.id == RoomMember.room_id)
+            .where(RoomMember.username == user)
+            .order_by(desc(Room.last_message_ts))
+        ),
+        "get_history": lambda: select(ChatLog).where(ChatLog.room_id == room).order_by(ChatLog.seq.desc()).limit(50),
+        "is_member": lambda: select(RoomMember.id).where(
+            and_(RoomMember.room_id == room, RoomMember.username == user)),
+        "list_followers": lambda: select(Follow.follower_username).where(Follow.followee_username == user),
+    }
+
+def cached_statements(user: str, room: str) -> dict:
+    return {
+        "get_user_info": (queries.USER_BY_NAME, {"username": user}),
+        "rooms_summary": (queries.ROOMS_SUMMARY, {"username": user}),
+        "get_history": (queries.HISTORY[False, False], {"room": room, "limit": 50}),
+        "is_member": (queries.IS_MEMBER, {"room": room, "username": user}),
+        "list_followers": (queries.FOLLOWERS, {"username": user}),
+    }
+
+async def seed(logs: int):
+    async with get_db() as db:
+        for u in BENCH_USERS:
+            db.add(User(username=u, password="bench", nickname=u))
+        db.add(Room(id=BENCH_ROOM, name=BENCH_ROOM, message_count=logs, last_seq=logs))
+        await db.flush()
+        for u in BENCH_USERS:
+            db.add(RoomMember(room_id=BENCH_ROOM, username=u))
+        db.add(Follow(follower_username=BENCH_USERS[1], followee_username=BENCH_USERS[0]))
+        await db.flush()
+        await db.execute(insert(ChatLog), [
+            {"room_id": BENCH_ROOM, "seq": i + 1, "kind": "msg", "from_user": BENCH_USERS[i % 2],
+             "from_nickname": BENCH_USERS[i % 2], "text": f"bench message {i}"}
+            for i in range(logs)
+        ])
+
+async def cleanup():
+    async with get_db() as db:
+        await db.execute(delete(Room).where(Room.id == BENCH_ROOM))
+        await db.execute(delete(User).where(User.username.in_(BENCH_USERS)))
+
+def build_cpu(make, repeat: int) -> float:
+    # 문장 생성 + 캐시 키 계산 + 컴파일 캐시 조회 (DB 왕복 없음)
+    dialect = postgresql.asyncpg.dialect()
+    cache = {}
+    t0 = time.process_time()
+    for _ in range(repeat):
+        stmt = make()
+        key, _ = stmt._generate_cache_key()
+        if key not in cache:
+            cache[key] = stmt.compile(dialect=dialect)
+    return (time.process_time() - t0) / repeat
+
+async def exec_cpu(run, repeat: int) -> float:
+    async with get_db() as db:
+        await run(db)  # 워밍업 (컴파일/PREPARE)
+        t0 = time.process_time()
+        for _ in range(repeat):
+            await run(db)
+        return (time.process_time() - t0) / repeat
+
+async def bench(repeat: int):
+    user, room = BENCH_USERS[0], BENCH_ROOM
+    legacy = legacy_statements(user, room)
+    cached = cached_statements(user, room)
+    print(f"\n{'query':<16}{'legacy build':>14}{'cached build':>14}{'legacy exec':>13}{'cached exec':>13}{'saved':>8}")
+    for name, make in legacy.items():
+        stmt, params = cached[name]
+        lb = build_cpu(make, repeat)
+        cb = build_cpu(lambda: stmt, repeat)
+
+        async def run_legacy(db, make=make):
+            (await db.execute(make())).all()
+
+        async def run_cached(db, stmt=stmt, params=params):
+            (await db.execute(stmt, params)).all()
+
+        le = await exec_cpu(run_legacy, repeat)
+        ce = await exec_cpu(run_cached, repeat)
+        print(f"{name:<16}{lb * 1e6:>12.0f}µs{cb * 1e6:>12.0f}µs{le * 1e6:>11.0f}µs{ce * 1e6:>11.0f}µs"
+              f"{(1 - ce / le) * 100:>7.0f}%")
+    print(f"   (호출당 CPU, exec = 생성 + 실행 + 결과 변환, "
+          f"query_cache_size={DB_QUERY_CACHE_SIZE}, prepared_statement_cache_size={DB_STATEMENT_CACHE_SIZE})")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--logs", type=int, default=100)
+    args = parser.parse_args()
+
+    await init_db()
+    await cleanup()
+    try:
+        await seed(args.logs)
+        await bench(args.repeat)
+    finally:
+        await cleanup()
+        await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+연결별 요청 동시 처리
+
+수신 루프가 op 하나의 DB 작업/fan-out이 끝날 때까지 다음 메시지를 읽지 않던 것을
+- op마다 태스크로 실행하되 연결당 동시에 최대 limit개 (넘으면 수신 루프가 기다림 = 백프레셔)
+- 같은 순서 키(예: 같은 방에 대한 쓰기)의 op는 앞의 op가 끝난 뒤 시작 (태스크 체인)
+- 키가 없는 op(조회)는 서로 기다리지 않음
+- BARRIER 키의 op(어느 방인지 실행해 봐야 아는 op, 예: 이름으로 join)는 앞의 순서 있는 op가 모두 끝난 뒤 시작하고,
+  뒤에 오는 순서 있는 op는 키와 상관없이 그 op가 끝난 뒤 시작
+으로 바꿈. 연결 종료 시 조회 op는 취소하고, 순서 키가 있는 쓰기 op는 끝까지 실행.
+"""
+
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Dict, Set
+
+
+# 모든 순서 키와 순서를 맞추는 키
+BARRIER = "*"
+
+
+class OpDispatcher:
+    # 모든 연결에서 제출됐지만 아직 끝나지 않은 op 수 (readiness 판단용)
+    pending = 0
+
+    def __init__(self, handler: Callable[[object], Awaitable[None]], limit: int):
+        self.handler = handler
+        self._slots = asyncio.Semaphore(max(1, limit))
+        # 순서 키 -> 그 키로 마지막에 들어온 태스크
+        self._chains: Dict[str, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._unordered: Set[asyncio.Task] = set()
+        # 마지막으로 들어온 BARRIER op (끝나면 None)
+        self._barrier: asyncio.Task | None = None
+
+    async def submit(self, op, key: str | None = None):
+        await self._slots.acquire()
+        if key is None:
+            prev = ()
+        elif key == BARRIER:
+            prev = (*self._chains.values(), *((self._barrier,) if self._barrier else ()))
+        else:
+            prev = tuple(t for t in (self._chains.get(key), self._barrier) if t is not None)
+        task = asyncio.create_task(self._run(op, prev))
+        self._tasks.add(task)
+        OpDispatcher.pending += 1
+        if key is None:
+            self._unordered.add(task)
+        elif key == BARRIER:
+            self._barrier = task
+        else:
+            self._chains[key] = task
+        task.add_done_callback(partial(self._done, key))
+
+    async def _run(self, op, prev: tuple):
+        try:
+            if prev:
+                # 앞 op의 예외/취소는 전파하지 않고 끝나기만 기다림
+                await asyncio.wait(prev)
+            await self.handler(op)
+        finally:
+            self._slots.release()
+
+    def _done(self, key: str | None, task: asyncio.Task):
+        OpDispatcher.pending -= 1
+        self._tasks.discard(task)
+        self._unordered.discard(task)
+        if key == BARRIER:
+            if self._barrier is task:
+                self._barrier = None
+        elif key is not None and self._chains.get(key) is task:
+            del self._chains[key]
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[WARN] op task failed: {task.exception()!r}")
+
+    async def close(self):
+        for task in self._unordered:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
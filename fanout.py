@@ -0,0 +1,104 @@
+"""
+대형 방 브로드캐스트용 fan-out 스케줄러
+
+대상 소켓 전체 리스트를 만들어 gather 한 번에 보내는 대신
+- 대상을 FANOUT_CHUNK_SIZE 개씩 이터레이터에서 꺼내고
+- 청크 안에서는 동시에 FANOUT_CONCURRENCY 개까지만 전송
+- 청크 사이마다 이벤트 루프에 양보해서, 수만 명 방의 브로드캐스트 도중에도
+  작은 방 메시지/다른 요청이 처리되도록 함
+방별 fan-out 소요 시간은 room_stats(최근 FANOUT_TRACK_ROOMS 개 방)와
+klav_fanout_seconds 히스토그램에 기록.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, List
+
+from serverHelper import _frame_for
+from session import Session
+from metrics import Counter, Histogram
+import tracing
+
+FANOUT_CHUNK_SIZE = int(os.getenv("FANOUT_CHUNK_SIZE", "500"))
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "100"))
+FANOUT_TRACK_ROOMS = int(os.getenv("FANOUT_TRACK_ROOMS", "1000"))
+
+fanout_seconds = Histogram("klav_fanout_seconds", "Fan-out duration per broadcast", ("size",))
+fanout_targets = Counter("klav_fanout_targets_total", "Sockets targeted by fan-out")
+
+
+def _size_class(n: int) -> str:
+    if n < 100:
+        return "small"
+    if n < 1000:
+        return "medium"
+    return "large"
+
+
+class FanoutScheduler:
+    def __init__(self, chunk_size: int = FANOUT_CHUNK_SIZE, concurrency: int = FANOUT_CONCURRENCY,
+                 track_rooms: int = FANOUT_TRACK_ROOMS):
+        self.chunk_size = max(1, chunk_size)
+        self.concurrency = max(1, min(concurrency, self.chunk_size))
+        self.track_rooms = track_rooms
+        # room_id -> [횟수, 누적 초, 최대 초, 마지막 대상 수] (LRU)
+        self.room_stats: "OrderedDict[str, list]" = OrderedDict()
+
+    async def send(self, targets: Iterable[Session], payload: dict, room_id: str | None = None) -> int:
+        with tracing.span("fanout", room=room_id) as sp:
+            sent = await self._send(targets, payload, room_id)
+            sp.set(targets=sent)
+        return sent
+
+    async def _send(self, targets: Iterable[Session], payload: dict, room_id: str | None) -> int:
+        t0 = time.perf_counter()
+        frames: dict[str, bytes] = {}
+        sent = 0
+        chunk: List[Session] = []
+        for session in targets:
+            chunk.append(session)
+            if len(chunk) >= self.chunk_size:
+                await self._send_chunk(chunk, payload, frames)
+                sent += len(chunk)
+                chunk = []
+                # 다음 청크 전에 다른 작업에 양보
+                await asyncio.sleep(0)
+        if chunk:
+            await self._send_chunk(chunk, payload, frames)
+            sent += len(chunk)
+
+        self._record(room_id, sent, time.perf_counter() - t0)
+        return sent
+
+    async def _send_chunk(self, chunk: List[Session], payload: dict, frames: dict[str, bytes]):
+        for i in range(0, len(chunk), self.concurrency):
+            await asyncio.gather(
+                *(s.send_frame(_frame_for(s, payload, frames)) for s in chunk[i:i + self.concurrency]),
+                return_exceptions=True
+            )
+
+    def _record(self, room_id: str | None, sent: int, elapsed: float):
+        fanout_seconds.observe(elapsed, size=_size_class(sent))
+        fanout_targets.inc(sent)
+        if room_id is None:
+            return
+        stats = self.room_stats.get(room_id)
+        if stats is None:
+            stats = self.room_stats[room_id] = [0, 0.0, 0.0, 0]
+            if len(self.room_stats) > self.track_rooms:
+                self.room_stats.popitem(last=False)
+        else:
+            self.room_stats.move_to_end(room_id)
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3] = sent
+
+    def slowest_rooms(self, n: int = 10) -> List[dict]:
+        top = sorted(self.room_stats.items(), key=lambda kv: kv[1][2], reverse=True)[:n]
+        return [
+            {"room": rid, "count": c, "avg_ms": total / c * 1000, "max_ms": mx * 1000, "last_targets": last}
+            for rid, (c, total, mx, last) in top
+        ]
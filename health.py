@@ -0,0 +1,112 @@
+"""
+liveness / readiness 프로브 (프로브 자체가 부하를 만들지 않도록 결과를 캐시)
+
+- /livez : I/O 없이 응답 (이벤트 루프가 요청을 처리하고 있으면 살아 있음)
+- /readyz: 요청마다 DB에 가지 않고 HealthChecker가 HEALTH_CHECK_INTERVAL마다 갱신한 결과를 반환
+  다음 중 하나라도 해당하면 ready=false (HTTP 503) -> 오케스트레이터/LB가 트래픽을 뺌
+  - database: SELECT 1이 HEALTH_DB_TIMEOUT 안에 끝나지 않거나 실패
+  - pool    : 주 DB 커넥션 풀 사용률 >= READY_MAX_POOL_USAGE
+  - loop_lag: 직전 검사 이후 이벤트 루프 지연 최대값 > READY_MAX_LOOP_LAG_MS
+  - backlog : 처리 대기 작업 수 > READY_MAX_BACKLOG
+  - stale   : 마지막 검사 결과가 너무 오래됨 (검사 태스크가 멈춤)
+  - starting: 시작 후 아직 첫 검사 전 (스키마 확인 + 풀 예열 이후에 시작)
+  - draining: 종료 drain 중
+"""
+
+import asyncio
+import os
+import time
+from typing import Callable, Tuple
+
+from database import ping, pool_usage
+from loopmon import monitor
+from metrics import Gauge
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "2.0"))
+HEALTH_DB_TIMEOUT = float(os.getenv("HEALTH_DB_TIMEOUT", "2.0"))
+READY_MAX_POOL_USAGE = float(os.getenv("READY_MAX_POOL_USAGE", "0.9"))
+READY_MAX_LOOP_LAG_MS = float(os.getenv("READY_MAX_LOOP_LAG_MS", "500"))
+READY_MAX_BACKLOG = int(os.getenv("READY_MAX_BACKLOG", "2000"))
+
+Gauge("klav_db_pool_in_use", "Checked-out connections in the primary DB pool", fn=lambda: pool_usage()[0])
+
+
+class HealthChecker:
+    def __init__(self, backlog: Callable[[], int]):
+        self.backlog = backlog
+        self.state: dict | None = None
+        self._checked_at = 0.0
+        self.draining = False
+        self._task: asyncio.Task | None = None
+        Gauge("klav_ready", "1 if the last readiness check passed", fn=lambda: int(self.snapshot()[0]))
+
+    def start(self):
+        self._task = asyncio.create_task(self._check_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _check_loop(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"[WARN] health check failed: {e!r}")
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+    async def check(self):
+        reasons = []
+        # 풀 사용량은 ping이 연결을 잡기 전에 읽음
+        in_use, capacity = pool_usage()
+        usage = in_use / capacity if capacity else 0.0
+        if usage >= READY_MAX_POOL_USAGE:
+            reasons.append("pool")
+
+        t0 = time.perf_counter()
+        try:
+            async with asyncio.timeout(HEALTH_DB_TIMEOUT):
+                await ping()
+            db = "ok"
+        except Exception as e:
+            db = "timeout" if isinstance(e, TimeoutError) else f"error: {e}"
+            reasons.append("database")
+        db_ms = (time.perf_counter() - t0) * 1000
+
+        # 지연 샘플링은 loopmon (직전 검사 이후 최대값)
+        lag = monitor.take_lag_max()
+        if lag * 1000 > READY_MAX_LOOP_LAG_MS:
+            reasons.append("loop_lag")
+
+        backlog = self.backlog()
+        if backlog > READY_MAX_BACKLOG:
+            reasons.append("backlog")
+
+        self.state = {
+            "ready": not reasons,
+            "reasons": reasons,
+            "database": db,
+            "db_latency_ms": round(db_ms, 1),
+            "pool": {"in_use": in_use, "capacity": capacity, "usage": round(usage, 3)},
+            "loop_lag_ms": round(lag * 1000, 1),
+            "backlog": backlog,
+        }
+        self._checked_at = time.monotonic()
+
+    def snapshot(self) -> Tuple[bool, dict]:
+        """캐시된 readiness 결과 (I/O 없음)"""
+        if self.state is None:
+            body = {"ready": False, "reasons": ["starting"]}
+        else:
+            age = time.monotonic() - self._checked_at
+            body = dict(self.state, age_ms=round(age * 1000))
+            # 검사 한 번이 DB 타임아웃까지 걸려도 stale로 보지 않도록 여유를 둠
+            if age > 2 * HEALTH_CHECK_INTERVAL + HEALTH_DB_TIMEOUT:
+                body["ready"] = False
+                body["reasons"] = body["reasons"] + ["stale"]
+        if self.draining:
+            body["ready"] = False
+            body["reasons"] = body["reasons"] + ["draining"]
+        return body["ready"], body
@@ -0,0 +1,165 @@
+"""
+이벤트 루프 지연 / 느린 스텝 모니터 (운영에서 켜 둘 수 있을 만큼 가볍게)
+
+- 지연: LAG_SAMPLE_INTERVAL마다 sleep이 예정보다 늦게 깨어난 시간 (루프를 막은 코드가 있으면 커짐)
+  klav_event_loop_lag_seconds 히스토그램 + 최근 1분 샘플 (/debug/loop, readiness)
+- 느린 스텝: 코루틴이 한 번 깨어나서 다음 await까지 루프를 잡고 있던 시간이 SLOW_STEP_MS 이상이면 기록
+  (JWT 검증, ORM 객체 변환처럼 await 없이 도는 CPU 작업이 여기에 잡힘)
+  WebSocket op는 op 종류, 나머지는 ws(연결 수신 루프) / http 로 구분
+  기록 위치(where)는 그 스텝이 끝나고 멈춘 앱 코드 위치 = 막고 있던 코드 바로 뒤
+
+스텝 시간은 루프 구현(uvloop 포함)과 무관하게 코루틴을 감싸서 잼 (스텝마다 perf_counter 두 번).
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Coroutine
+
+from metrics import Counter, Histogram
+
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "1") == "1"
+SLOW_STEP_MS = float(os.getenv("SLOW_STEP_MS", "100"))
+SLOW_LOG_SIZE = int(os.getenv("SLOW_LOG_SIZE", "200"))
+
+LAG_SAMPLE_INTERVAL = 0.1
+LAG_HISTORY = 600  # 최근 1분
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+lag_seconds = Histogram("klav_event_loop_lag_seconds", "Event loop wake-up delay per sample",
+                        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+slow_steps = Counter("klav_slow_steps_total", "Coroutine steps that held the event loop too long", ("op",))
+slow_step_seconds = Counter("klav_slow_step_seconds_total", "Time spent in slow coroutine steps", ("op",))
+
+
+def _where(coro) -> str:
+    # await 체인을 따라 내려가며 마지막 앱 코드 프레임 (라이브러리/asyncio 프레임은 건너뜀)
+    found = None
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        if frame.f_code.co_filename.startswith(_APP_DIR):
+            found = frame
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    if found is None:
+        return "-"
+    return f"{found.f_code.co_name} ({os.path.basename(found.f_code.co_filename)}:{found.f_lineno})"
+
+
+class _Timed:
+    """코루틴을 그대로 실행하면서 send/throw 한 번(= 스텝 하나)마다 시간을 잼"""
+    __slots__ = ("coro", "op")
+
+    def __init__(self, coro: Coroutine, op: str):
+        self.coro = coro
+        self.op = op
+
+    def __await__(self):
+        coro = self.coro
+        send, exc = None, None
+        while True:
+            t0 = time.perf_counter()
+            try:
+                if exc is None:
+                    fut = coro.send(send)
+                else:
+                    fut = coro.throw(exc)
+            except StopIteration as e:
+                monitor.step(self.op, time.perf_counter() - t0, None)
+                return e.value
+            except BaseException:
+                monitor.step(self.op, time.perf_counter() - t0, None)
+                raise
+            monitor.step(self.op, time.perf_counter() - t0, coro)
+            try:
+                send, exc = (yield fut), None
+            except BaseException as e:  # 취소 등은 감싼 코루틴에 그대로 전달
+                send, exc = None, e
+
+
+def timed(coro: Coroutine, op: str):
+    """await timed(handler(...), op): 느린 스텝을 op 이름으로 기록 (LOOP_MONITOR=0이면 그대로 반환)"""
+    return _Timed(coro, op) if LOOP_MONITOR else coro
+
+
+class LoopMonitor:
+    def __init__(self):
+        self.threshold = SLOW_STEP_MS / 1000
+        self.slow_log: deque = deque(maxlen=SLOW_LOG_SIZE)
+        self.lag_history: deque = deque(maxlen=LAG_HISTORY)
+        self._lag_max = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._lag_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _lag_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            lag = max(0.0, loop.time() - t0 - LAG_SAMPLE_INTERVAL)
+            lag_seconds.observe(lag)
+            self.lag_history.append(lag)
+            if lag > self._lag_max:
+                self._lag_max = lag
+
+    def take_lag_max(self) -> float:
+        """직전 호출 이후 최대 지연(초), 호출하면 0부터 다시 (HealthChecker용)"""
+        lag, self._lag_max = self._lag_max, 0.0
+        return lag
+
+    def step(self, op: str, elapsed: float, coro):
+        if elapsed < self.threshold:
+            return
+        slow_steps.inc(op=op)
+        slow_step_seconds.inc(elapsed, op=op)
+        self.slow_log.append({
+            "ts": time.time(),
+            "op": op,
+            "ms": round(elapsed * 1000, 1),
+            "where": _where(coro) if coro is not None else "(returned)",
+        })
+
+    def snapshot(self) -> dict:
+        lags = sorted(self.lag_history)
+        by_op: dict = {}
+        for entry in self.slow_log:
+            agg = by_op.setdefault(entry["op"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            agg["count"] += 1
+            agg["total_ms"] = round(agg["total_ms"] + entry["ms"], 1)
+            agg["max_ms"] = max(agg["max_ms"], entry["ms"])
+
+        def pct(p: float) -> float:
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))] * 1000, 1) if lags else 0.0
+
+        return {
+            "lag_ms": {"p50": pct(0.5), "p99": pct(0.99), "max": pct(1.0), "samples": len(lags)},
+            "slow_step_ms": SLOW_STEP_MS,
+            "by_op": by_op,
+            "slow": list(reversed(self.slow_log)),
+        }
+
+
+monitor = LoopMonitor()
+
+
+class LoopMonitorMiddleware:
+    """HTTP 요청 / WebSocket 연결 태스크의 스텝도 http / ws 이름으로 기록 (op 태스크는 _run_op에서 따로 감쌈)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            await timed(self.app(scope, receive, send), "ws" if scope["type"] == "websocket" else "http")
+        else:
+            await self.app(scope, receive, send)
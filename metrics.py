@@ -0,0 +1,133 @@
+"""
+프로세스 내 메트릭 (Prometheus 텍스트 포맷으로 /metrics 에 노출)
+
+외부 의존성 없이 Counter / Gauge / Histogram 만 최소로 구현.
+라벨 조합마다 값 하나씩 보관하므로 라벨 값은 종류가 적은 것만 사용할 것.
+"""
+
+import math
+from typing import Callable, Dict, List, Tuple
+
+REGISTRY: List["_Metric"] = []
+
+LabelKey = Tuple[str, ...]
+
+
+def _fmt_labels(names: Tuple[str, ...], values: LabelKey, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_, labelnames)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_: str, labelnames: Tuple[str, ...] = (),
+                 fn: Callable[[], float] | None = None):
+        super().__init__(name, help_, labelnames)
+        self.values: Dict[LabelKey, float] = {}
+        self.fn = fn  # 라벨 없는 게이지는 렌더링 시점에 fn()으로 읽을 수 있음
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def clear(self):
+        self.values.clear()
+
+    def samples(self) -> List[str]:
+        if self.fn is not None:
+            return [f"{self.name} {_fmt_value(self.fn())}"]
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in self.values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, help_: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # 라벨별 [버킷 카운트..., 합계, 개수]
+        self.values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [0] * (len(self.buckets) + 2)
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                row[i] += 1
+                break
+        row[-2] += value
+        row[-1] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, row in self.values.items():
+            acc = 0
+            for i, b in enumerate(self.buckets):
+                acc += row[i]
+                le = f'le="{_fmt_value(b)}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {_fmt_value(acc)}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(row[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {_fmt_value(row[-1])}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
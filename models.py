@@ -41,6 +41,8 @@ class Room(Base):
     last_message_from = Column(String(100), nullable=True)
     last_message_kind = Column(String(20), nullable=True)
     last_message_ts = Column(DateTime(timezone=True), nullable=True)
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")  # DM 제외 누적 메시지 수
+    last_seq = Column(Integer, nullable=False, default=0, server_default="0")  # 마지막으로 발급한 ChatLog.seq
     
     # 관계
     members = relationship("RoomMember", back_populates="room", cascade="all, delete-orphan")
@@ -58,6 +60,8 @@ class RoomMember(Base):
     room_id = Column(String(20), ForeignKey("rooms.id", ondelete="CASCADE"), nullable=False)
     username = Column(String(100), ForeignKey("users.username", ondelete="CASCADE"), nullable=False)
     joined_at = Column(DateTime(timezone=True), default=now_utc)
+    last_read_id = Column(Integer, nullable=False, default=0, server_default="0")  # 마지막으로 읽은 ChatLog.id
+    read_count = Column(Integer, nullable=False, default=0, server_default="0")  # 읽은 시점의 Room.message_count
     
     # 관계
     room = relationship("Room", back_populates="members")
@@ -74,6 +78,7 @@ class ChatLog(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     room_id = Column(String(20), ForeignKey("rooms.id", ondelete="CASCADE"), nullable=False)
     ts = Column(DateTime(timezone=True), default=now_utc, index=True)
+    seq = Column(Integer, nullable=True)  # 방별 단조 증가 번호 (Room.last_seq에서 발급)
     kind = Column(String(20), nullable=False)  # msg, dm, system
     from_user = Column(String(100), nullable=False)
     from_nickname = Column(String(100), default="")
@@ -85,7 +90,10 @@ class ChatLog(Base):
     
     __table_args__ = (
         Index('idx_room_ts', 'room_id', 'ts'),
+        Index('idx_room_log_id', 'room_id', 'id'),
+        Index('idx_room_seq', 'room_id', 'seq', unique=True),
         Index('idx_kind', 'kind'),
+        Index('idx_chat_text_trgm', 'text', postgresql_using='gin', postgresql_ops={'text': 'gin_trgm_ops'}),
     )
 
 # 팔로우 관계 테이블
@@ -0,0 +1,67 @@
+"""
+요청 시에만 도는 샘플링 CPU 프로파일러 (/debug/profile)
+
+- 프로파일 중에만 샘플링 스레드를 띄우고 끝나면 종료 (평소 오버헤드 없음, 재시작 불필요)
+- interval마다 이벤트 루프 스레드의 현재 스택(sys._current_frames)을 읽어 같은 스택끼리 횟수를 셈
+- 스택 맨 앞에 그 순간 실행 중인 태스크의 코루틴 이름을 붙임 (예: task:ConnectionManager._heartbeat_loop,
+  task:OpDispatcher._run) -> 같은 함수라도 어느 태스크에서 돌았는지 구분
+  루프가 놀고 있으면 (idle), 태스크 밖 콜백(프로토콜 수신 처리 등)이면 (callback)
+- 결과는 collapsed stack 형식 ("프레임;프레임;... 횟수" 한 줄씩)
+  flamegraph.pl, speedscope(https://www.speedscope.app), inferno 등에 바로 넣을 수 있음
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# 한 번에 하나만 (샘플링 스레드 두 개가 서로의 샘플을 흐리지 않도록)
+_lock = asyncio.Lock()
+
+
+def busy() -> bool:
+    return _lock.locked()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _task_name(task, leaf) -> str:
+    if task is None:
+        # 태스크 밖: selector에서 대기 중이면 유휴, 아니면 프로토콜 콜백 등 (예: 소켓 수신 처리)
+        return "(idle)" if leaf.f_code.co_name == "select" else "(callback)"
+    coro = task.get_coro()
+    return "task:" + getattr(coro, "__qualname__", type(coro).__name__)
+
+
+def _sample(loop: asyncio.AbstractEventLoop, loop_tid: int, seconds: float, interval: float) -> Counter:
+    stacks: Counter = Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(loop_tid)
+        if frame is not None:
+            leaf, names = frame, []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            names.append(_task_name(asyncio.current_task(loop), leaf))
+            stacks[";".join(reversed(names))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+async def profile(seconds: float, interval: float) -> str:
+    """seconds 동안 이벤트 루프 스레드를 interval 간격으로 샘플링해 collapsed stack 문자열로 반환
+    (이벤트 루프에서 호출해야 함, 샘플링 중에도 루프는 그대로 요청을 처리)"""
+    seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+    interval = max(0.001, interval)
+    loop = asyncio.get_running_loop()
+    async with _lock:
+        stacks = await asyncio.to_thread(_sample, loop, threading.get_ident(), seconds, interval)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
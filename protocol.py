@@ -0,0 +1,171 @@
+"""
+WebSocket 와이어 프로토콜
+
+- 연결 시 WebSocket 서브프로토콜로 인코딩 협상
+    * klav.json    : JSON 텍스트 프레임 (기본, 서브프로토콜을 안 보내도 JSON)
+    * klav.msgpack : MessagePack 바이너리 프레임 (모바일용)
+- 수신 메시지는 타입별 msgspec Struct로 디코딩 (검증 + 디코딩을 한 번에)
+"""
+
+from typing import Dict, Optional, Union
+import msgspec
+
+
+# ---------- 수신 메시지 스키마 ----------
+class Op(msgspec.Struct, tag_field="type", kw_only=True):
+    # 클라이언트가 붙이면 이 요청에 대한 응답(ack/에러/조회 결과)에 그대로 돌려줌
+    req_id: Union[str, int, None] = None
+
+class RoomOp(Op):
+    room_id: Optional[str] = None
+    room: Optional[str] = None  # 구버전 클라이언트 호환 (room_id 대신)
+
+    @property
+    def rid(self) -> Optional[str]:
+        return self.room_id or self.room
+
+class CreateRoom(Op, tag="create_room"):
+    name: str = ""
+
+class Join(RoomOp, tag="join"):
+    pass  # room_id 또는 room(방 이름)
+
+class Leave(RoomOp, tag="leave"):
+    pass
+
+class Msg(RoomOp, tag="msg"):
+    text: str = ""
+
+class RoomDm(RoomOp, tag="room_dm"):
+    to: Optional[str] = None
+    text: str = ""
+
+class MyRooms(Op, tag="my_rooms"):
+    pass
+
+class MarkRead(RoomOp, tag="mark_read"):
+    last_read_id: Optional[int] = None
+
+class Typing(RoomOp, tag="typing"):
+    active: bool = True
+
+class ReadReceipt(RoomOp, tag="read_receipt"):
+    last_read_id: Optional[int] = None
+
+class RoomFocus(RoomOp, tag="room_focus"):
+    pass
+
+class RoomBlur(RoomOp, tag="room_blur"):
+    pass
+
+class InitialSync(Op, tag="initial_sync"):
+    limit: int = 20
+    since: Dict[str, int] = {}
+
+class Resume(Op, tag="resume"):
+    rooms: Dict[str, int] = {}
+
+class History(RoomOp, tag="history"):
+    limit: int = 20
+    before: Optional[str] = None
+    after: Optional[str] = None
+
+class Search(RoomOp, tag="search"):
+    q: str = ""
+    limit: int = 20
+    cursor: Optional[str] = None
+
+class FriendFollow(Op, tag="friend_follow"):
+    to: Optional[str] = None
+
+class FriendUnfollow(Op, tag="friend_unfollow"):
+    to: Optional[str] = None
+
+class FollowingList(Op, tag="following_list"):
+    pass
+
+class FollowersList(Op, tag="followers_list"):
+    pass
+
+class GetOnlineFriends(Op, tag="get_online_friends"):
+    pass
+
+class PresenceFriendsSubscribe(Op, tag="presence_friends_subscribe"):
+    pass
+
+class PresenceFriendsUnsubscribe(Op, tag="presence_friends_unsubscribe"):
+    pass
+
+class Pong(Op, tag="pong"):
+    pass  # 서버 ping 이벤트에 대한 응답
+
+IncomingOp = Union[
+    CreateRoom, Join, Leave, Msg, RoomDm, MyRooms, MarkRead, Typing, ReadReceipt, RoomFocus, RoomBlur,
+    InitialSync, Resume, History, Search, FriendFollow, FriendUnfollow, FollowingList, FollowersList,
+    GetOnlineFriends, PresenceFriendsSubscribe, PresenceFriendsUnsubscribe, Pong,
+]
+
+def op_type(op: Op) -> str:
+    return op.__struct_config__.tag
+
+DecodeError = (msgspec.DecodeError, msgspec.ValidationError)
+
+
+# ---------- 코덱 ----------
+class Codec:
+    name: str = ""
+    binary: bool = False
+
+    def encode(self, payload: dict) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, raw: bytes | str) -> Op:
+        raise NotImplementedError
+
+    def encode_batch(self, frames: list[bytes]) -> bytes:
+        # 이미 인코딩된 프레임을 다시 디코딩하지 않고 그대로 이어붙여 batch 프레임 하나로
+        return self.encode({"type": "batch", "items": [msgspec.Raw(f) for f in frames]})
+
+class JsonCodec(Codec):
+    name = "klav.json"
+    binary = False
+
+    def __init__(self):
+        self._enc = msgspec.json.Encoder()
+        # strict=False: "limit": "20" 같은 문자열 숫자도 허용 (기존 int(...) 동작과 동일)
+        self._dec = msgspec.json.Decoder(IncomingOp, strict=False)
+
+    def encode(self, payload: dict) -> bytes:
+        return self._enc.encode(payload)
+
+    def decode(self, raw: bytes | str) -> Op:
+        return self._dec.decode(raw)
+
+class MsgpackCodec(Codec):
+    name = "klav.msgpack"
+    binary = True
+
+    def __init__(self):
+        self._enc = msgspec.msgpack.Encoder()
+        self._dec = msgspec.msgpack.Decoder(IncomingOp, strict=False)
+
+    def encode(self, payload: dict) -> bytes:
+        return self._enc.encode(payload)
+
+    def decode(self, raw: bytes | str) -> Op:
+        if isinstance(raw, str):
+            raw = raw.encode()
+        return self._dec.decode(raw)
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+CODECS: Dict[str, Codec] = {c.name: c for c in (JSON, MSGPACK)}
+
+def negotiate(offered: list[str]) -> tuple[Codec, Optional[str]]:
+    """클라이언트가 제시한 서브프로토콜 중 처음으로 지원하는 것을 선택
+    반환: (코덱, accept 시 돌려줄 서브프로토콜 - 제시가 없었으면 None)"""
+    for name in offered:
+        codec = CODECS.get(name)
+        if codec:
+            return codec, name
+    return JSON, None
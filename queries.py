@@ -0,0 +1,73 @@
+"""
+자주 실행하는 조회문 (모듈 로드 시 한 번만 생성)
+
+요청마다 select(...)를 새로 만들면 문장 생성 + 캐시 키 계산이 매번 Python CPU를 씀.
+여기의 문장은 값 자리를 bindparam으로 두고 객체를 재사용하므로
+- SQLAlchemy: 캐시 키가 문장 객체에 메모되어 컴파일 캐시(query_cache_size)에서 바로 찾고
+- asyncpg   : SQL 문자열이 항상 같아 연결별 prepared statement 캐시(prepared_statement_cache_size)에 걸림
+ORM 엔티티 대신 필요한 컬럼만 조회해서 identity map 처리도 생략 (_log_item/_room_item은 Row도 받음).
+
+사용: await db.execute(queries.ROOMS_OF, {"username": username})
+"""
+
+from datetime import datetime, timezone
+from sqlalchemy import select, and_, desc, bindparam
+
+from models import User, Room, RoomMember, ChatLog, Follow
+
+LOG_COLUMNS = (ChatLog.id, ChatLog.seq, ChatLog.ts, ChatLog.kind, ChatLog.room_id, ChatLog.from_user,
+               ChatLog.from_nickname, ChatLog.to_user, ChatLog.text)
+ROOM_COLUMNS = (Room.id, Room.name, Room.last_message_text, Room.last_message_from, Room.last_message_kind,
+                Room.last_message_ts, Room.message_count)
+
+# get_user_info / _get_nickname
+USER_BY_NAME = (
+    select(User.username, User.password, User.extra, User.nickname)
+    .where(User.username == bindparam("username"))
+)
+
+# rooms_summary
+ROOMS_SUMMARY = (
+    select(*ROOM_COLUMNS, RoomMember.last_read_id, RoomMember.read_count)
+    .join(RoomMember, Room.id == RoomMember.room_id)
+    .where(RoomMember.username == bindparam("username"))
+    .order_by(desc(Room.last_message_ts))
+)
+
+# rooms_of / is_member
+ROOMS_OF = select(RoomMember.room_id).where(RoomMember.username == bindparam("username"))
+IS_MEMBER = (
+    select(RoomMember.id)
+    .where(and_(RoomMember.room_id == bindparam("room"), RoomMember.username == bindparam("username")))
+)
+
+# _targets_in_room (메시지/입장/퇴장 fan-out 대상)
+ROOM_MEMBERS = select(RoomMember.username).where(RoomMember.room_id == bindparam("room"))
+
+# list_following / list_followers
+FOLLOWING = select(Follow.followee_username).where(Follow.follower_username == bindparam("username"))
+FOLLOWERS = select(Follow.follower_username).where(Follow.followee_username == bindparam("username"))
+
+
+def _history(after: bool, before: bool):
+    stmt = select(*LOG_COLUMNS).where(ChatLog.room_id == bindparam("room"))
+    if after:
+        stmt = stmt.where(ChatLog.ts > bindparam("after"))
+    if before:
+        stmt = stmt.where(ChatLog.ts < bindparam("before"))
+    return stmt.order_by(ChatLog.seq.desc()).limit(bindparam("limit"))
+
+# get_history: after/before 조합별로 4개 (WHERE 모양이 다르면 SQL도 달라지므로 미리 만들어 둠)
+HISTORY = {(a, b): _history(a, b) for a in (False, True) for b in (False, True)}
+
+# 시작 시 database.warm_pool()이 미리 연 연결마다 한 번씩 실행 (결과 없는 값으로 컴파일/PREPARE만)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+WARMUP = [
+    (USER_BY_NAME, {"username": ""}),
+    (ROOMS_SUMMARY, {"username": ""}),
+    (ROOMS_OF, {"username": ""}),
+    (IS_MEMBER, {"room": "", "username": ""}),
+    (FOLLOWING, {"username": ""}),
+    (FOLLOWERS, {"username": ""}),
+    *((stmt, {"room": "", "limit": 1, "after": _EPOCH, "before": _EPOCH}) for stmt in HISTORY.values()),
+]
@@ -1,10 +1,15 @@
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, status
+from starlette.requests import HTTPConnection
 from datetime import datetime, timedelta, timezone
 import asyncio
+import os
 import re
+from typing import Callable
+from protocol import Codec, JSON
 
-def extract_token(ws: WebSocket) -> str | None:
-    auth = ws.headers.get("authorization")
+def extract_token(conn: HTTPConnection) -> str | None:
+    # WebSocket / HTTP Request 공통
+    auth = conn.headers.get("authorization")
     if not auth:
         return None
     # e.g. "Bearer xxx.yyy.zzz"
@@ -19,8 +24,66 @@ def _parse_iso(ts: str) -> datetime:
     # "Z"도 허용
     return datetime.fromisoformat(ts.replace("Z", "+00:00"))
 
-async def _send_json_many(sockets: list[WebSocket], payload: dict):
-    await asyncio.gather(*(ws.send_json(payload) for ws in sockets), return_exceptions=True)
+SESSION_SCOPE_KEY = "klav.session"
+
+def _session_of(ws: WebSocket):
+    # ConnectionManager.accept가 붙여둔 session.Session (accept 전이면 None)
+    return ws.scope.get(SESSION_SCOPE_KEY)
+
+# 프레임 하나 전송 제한 시간(초): 반쯤 끊긴 소켓의 송신 버퍼가 차서 send가 멈추면 fan-out 전체가 막힘
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5.0"))
+
+# 전송 실패/타임아웃 시 호출 (ConnectionManager가 등록해서 소켓을 바로 정리)
+_send_failure_handler: Callable[[WebSocket, BaseException], None] | None = None
+
+def set_send_failure_handler(handler: Callable[[WebSocket, BaseException], None] | None):
+    global _send_failure_handler
+    _send_failure_handler = handler
+
+def _report_send_failure(ws: WebSocket, exc: BaseException):
+    if _send_failure_handler is not None:
+        _send_failure_handler(ws, exc)
+
+async def _write_frame(ws: WebSocket, codec: Codec, frame: bytes):
+    try:
+        async with asyncio.timeout(SEND_TIMEOUT):
+            if codec.binary:
+                await ws.send_bytes(frame)
+            else:
+                await ws.send_text(frame.decode("utf-8"))
+    except Exception as e:
+        _report_send_failure(ws, e)
+        # 호출한 쪽(수신 루프)에서는 끊긴 연결과 같게 처리
+        raise WebSocketDisconnect(status.WS_1011_INTERNAL_ERROR) from e
+
+async def _send(ws: WebSocket, payload: dict):
+    session = _session_of(ws)
+    if session is not None:
+        await session.send(payload)
+    else:
+        await _write_frame(ws, JSON, JSON.encode(payload))
+
+def _frame_for(session, payload: dict, frames: dict[str, bytes]) -> bytes:
+    # 코덱별로 한 번만 인코딩해서 같은 프레임을 재사용
+    codec = session.codec
+    frame = frames.get(codec.name)
+    if frame is None:
+        frame = frames[codec.name] = codec.encode(payload)
+    return frame
+
+async def _send_many(sessions: list, payload: dict):
+    frames: dict[str, bytes] = {}
+    await asyncio.gather(*(s.send_frame(_frame_for(s, payload, frames)) for s in sessions),
+                         return_exceptions=True)
+
+async def _receive_raw(ws: WebSocket) -> bytes | str:
+    # receive_json 대신 텍스트/바이너리 프레임을 그대로 받아 코덱에 넘김
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return message["bytes"]
+    return message.get("text") or ""
 
     
 def _evt(type_: str, **kwargs) -> dict:
@@ -1,30 +1,65 @@
 import time
-from typing import Dict, Optional, Literal
+import json
+import zlib
+import base64
+from typing import Dict, Optional, Literal, AsyncIterator, Iterator
 import jwt
 from jwt import ExpiredSignatureError, InvalidTokenError
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, WebSocketException, HTTPException, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, WebSocketException, HTTPException, Request, status
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel, Field
 import uvicorn
 from collections import defaultdict, deque
 from typing import Dict, Set, Deque, List
 from datetime import datetime, timedelta, timezone
 import asyncio
+import contextvars
 import os
 from dataclasses import asdict, replace
 import secrets
-from sqlalchemy import select, delete, and_, or_, func, desc
+import random
+import gc
+import tracemalloc
+from functools import partial
+from sqlalchemy import select, update, delete, and_, or_, func, desc, cast, tuple_, Float, bindparam
+from sqlalchemy import values, column, true, String, Integer, DateTime, insert, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from data import LoginReq, UserInfo, RoomInfo
-from serverHelper import extract_token, now_utc, _parse_iso, _evt, _send_json_many, is_valid_room_id
-from database import get_db, init_db, close_db, AsyncSessionLocal
+from serverHelper import extract_token, now_utc, _parse_iso, _evt, _send, _send_many, _receive_raw, is_valid_room_id
+from serverHelper import SEND_TIMEOUT, SESSION_SCOPE_KEY, set_send_failure_handler, _session_of
+from protocol import Codec, DecodeError, op_type, negotiate
+from ws_compression import CompressedWebSocketProtocol, WS_DEFLATE
+from fanout import FanoutScheduler
+from batching import FrameBatcher, parse_batch_window
+from session import Session
+from dispatcher import OpDispatcher, BARRIER
+from health import HealthChecker
+from loopmon import monitor, timed, LoopMonitorMiddleware
+import profiler
+import tracing
+import metrics
+import queries
+from database import get_db, init_db, warm_pool, close_db, AsyncSessionLocal, read_bind, current_user, pin_primary
+from database import deadline, is_timeout, op_deadline, pinned_users
 from models import User, Room, RoomMember, ChatLog, Follow
 
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
 JWT_ALG = os.getenv("JWT_ALGORITHM", "HS256")
 JWT_EXPIRE_MIN = 60
 
+# WebSocket 프로토콜 레벨 ping (브라우저가 자동 응답, 응답 없으면 uvicorn이 연결을 끊음)
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "20"))
+
 app = FastAPI()
+app.add_middleware(LoopMonitorMiddleware)
+
+# /debug/* 엔드포인트를 볼 수 있는 사용자 (쉼표 구분, 비어 있으면 아무도 못 봄)
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
 
 def create_access_token(sub: str) -> str:
     now = datetime.now(timezone.utc)
@@ -43,6 +78,28 @@ def verify_token(token: str) -> dict:
     except InvalidTokenError:
         raise HTTPException(status_code=status.WS_1008_POLICY_VIOLATION, detail="Invalid token")
 
+def http_username(request: Request) -> str:
+    # HTTP 엔드포인트용 Bearer 인증 (verify_token의 WS 코드 대신 401)
+    token = extract_token(request)
+    if not token:
+        raise HTTPException(status_code=401, detail="missing bearer token")
+    try:
+        payload = verify_token(token)
+    except HTTPException as e:
+        raise HTTPException(status_code=401, detail=e.detail)
+    username = payload.get("sub")
+    if not username:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # 이 요청에서 쓴 뒤의 읽기는 주 DB로 (database.get_db)
+    current_user.set(username)
+    return username
+
+def admin_username(request: Request) -> str:
+    username = http_username(request)
+    if username not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="admin only")
+    return username
+
 @app.post("/login")
 async def login(body: LoginReq):
     if not body.username or not body.password:
@@ -65,69 +122,407 @@ async def register(body: LoginReq):
         raise HTTPException(status_code=400, detail="invalid username")
     return {"status": status_}
 
+@app.get("/livez")
+async def liveness():
+    """liveness 프로브: I/O 없음 (이벤트 루프가 응답하면 alive)"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """readiness 프로브: HealthChecker가 주기적으로 갱신한 결과 (준비 안 됨이면 503)"""
+    ready, body = health.snapshot()
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 @app.get("/health")
 async def health_check():
-    """헬스체크 엔드포인트"""
+    """헬스체크 엔드포인트 (이전 형식 유지, DB 상태는 캐시된 검사 결과)"""
+    _, body = health.snapshot()
+    if body.get("database") != "ok":
+        raise HTTPException(status_code=503, detail=f"Service unhealthy: {body.get('database', 'starting')}")
+    return {"status": "healthy", "database": "connected"}
+
+@app.get("/debug/loop")
+async def debug_loop(request: Request):
+    """이벤트 루프 지연 분포(최근 1분)와 최근 느린 스텝 목록 (ADMIN_USERS만)"""
+    admin_username(request)
+    return monitor.snapshot()
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 10, interval_ms: float = 5):
+    """seconds 동안 샘플링한 CPU 프로파일 (collapsed stack, flamegraph.pl / speedscope용, ADMIN_USERS만)"""
+    admin_username(request)
+    if profiler.busy():
+        raise HTTPException(status_code=409, detail="profile already running")
+    body = await profiler.profile(seconds, interval_ms / 1000)
+    filename = f"klav-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.collapsed"
+    return PlainTextResponse(body, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/debug/traces")
+async def debug_traces(request: Request, op: str | None = None, limit: int = 20):
+    """최근 샘플링된 op 트레이스 (최신순, TRACE_SAMPLE_RATE > 0 일 때만 쌓임, ADMIN_USERS만)"""
+    admin_username(request)
+    return {"sample_rate": tracing.TRACE_SAMPLE_RATE, "traces": tracing.snapshot(op, max(1, min(limit, 200)))}
+
+# 0보다 크면 시작할 때 tracemalloc을 켜고 할당마다 이만큼의 프레임을 기록 (/debug/memory, 켜면 느려짐)
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "0"))
+_last_snapshot: tracemalloc.Snapshot | None = None
+
+def _rss_bytes() -> int | None:
     try:
-        # DB 연결 확인
-        async with get_db() as db:
-            from sqlalchemy import text
-            await db.execute(text("SELECT 1"))
-        return {"status": "healthy", "database": "connected"}
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Service unhealthy: {str(e)}")
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+@app.get("/debug/memory")
+async def debug_memory(request: Request, top: int = 15, collect: bool = False, mark: bool = True):
+    """프로세스 메모리, 연결 관리 구조별 크기, tracemalloc 상위 할당 위치와 기준 스냅샷 대비 증가분 (ADMIN_USERS만)
+    mark=true(기본)면 이번 스냅샷이 다음 호출의 기준이 됨 (false면 기준 유지)"""
+    global _last_snapshot
+    admin_username(request)
+    if collect:
+        gc.collect()
+    body = {
+        "rss_bytes": _rss_bytes(),
+        "registries": dict(manager.registry_sizes(), inflight_ops=OpDispatcher.pending,
+                           primary_pins=pinned_users(), traces=len(tracing.recent)),
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        body["tracemalloc"] = {
+            "current_bytes": current,
+            "peak_bytes": peak,
+            "top": [{"where": str(st.traceback), "size_bytes": st.size, "count": st.count}
+                    for st in snapshot.statistics("lineno")[:top]],
+            "growth": [{"where": str(st.traceback), "size_diff_bytes": st.size_diff, "count_diff": st.count_diff}
+                       for st in snapshot.compare_to(_last_snapshot, "lineno")[:top]] if _last_snapshot else [],
+        }
+        if mark or _last_snapshot is None:
+            _last_snapshot = snapshot
+    return body
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 텍스트 포맷 메트릭"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def _gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip 컨테이너
+    async for chunk in chunks:
+        out = gz.compress(chunk)
+        if out:
+            yield out
+    yield gz.flush()
+
+@app.get("/search")
+async def search(request: Request, q: str, room_id: str | None = None,
+                 limit: int = 20, cursor: str | None = None):
+    """WebSocket search의 HTTP 버전"""
+    username = http_username(request)
+    if len(q.strip()) < manager.SEARCH_MIN_LEN:
+        raise HTTPException(status_code=400, detail="query too short")
+    try:
+        items, next_cursor = await manager.search_messages(username, q.strip(), room_id=room_id,
+                                                           limit=limit, cursor=cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return {"q": q, "items": items, "next": next_cursor,
+            "recent_only": len(q.strip()) < manager.SEARCH_TRGM_MIN_LEN}
+
+@app.get("/rooms/{room_id}/export")
+async def export_room(room_id: str, request: Request,
+                      format: Literal["ndjson", "gzip"] = "ndjson", since: int = 0):
+    """방 chat_logs 전체를 NDJSON(또는 gzip)으로 스트리밍. since = 마지막으로 받은 로그 id
+    DM은 당사자 것만, ADMIN_USERS는 방의 모든 DM 포함 (보관/감사용 전체 export)"""
+    username = http_username(request)
+    if not await manager.is_member(room_id, username):
+        raise HTTPException(status_code=403, detail="not a room member")
+
+    viewer = None if username in ADMIN_USERS else username
+    body = manager.iter_room_export(room_id, since=since, viewer=viewer)
+    filename = f"{room_id}.ndjson"
+    media_type = "application/x-ndjson"
+    if format == "gzip":
+        body = _gzip_stream(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def _visible_to(username: str):
+    # 방 로그 중 username이 볼 수 있는 것: DM은 당사자(보낸 사람/받는 사람)만
+    return or_(ChatLog.kind != "dm", ChatLog.from_user == username, ChatLog.to_user == username)
+
+def _log_item(log) -> dict:
+    # ChatLog ORM 객체 / Core Row 공통
+    return {
+        "id": log.id,
+        "seq": log.seq,
+        "ts": log.ts.isoformat(),
+        "kind": log.kind,
+        "room": log.room_id,
+        "from": log.from_user,
+        "from_nickname": log.from_nickname,
+        "text": log.text,
+        **({"to": log.to_user} if log.to_user else {})
+    }
+
+def _room_item(room: Room, last_read_id: int, read_count: int) -> dict:
+    # Room ORM 객체 / queries.ROOM_COLUMNS Row 공통
+    last_info = None
+    if room.last_message_text:
+        last_info = {
+            "text": room.last_message_text,
+            "from": room.last_message_from,
+            "kind": room.last_message_kind,
+            "ts": room.last_message_ts.isoformat() if room.last_message_ts else None
+        }
+    return {
+        "id": room.id,
+        "name": room.name,
+        "last": last_info,
+        "last_read_id": last_read_id,
+        "unread": max(0, room.message_count - read_count)
+    }
+
+def _encode_cursor(*parts) -> str:
+    return base64.urlsafe_b64encode(json.dumps(parts).encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple[float, datetime, int]:
+    """검색 커서 (rank, ts, id) 복원. 모양이 다르면 ValueError (호출부에서 INVALID_CURSOR/400)"""
+    parts = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not (isinstance(parts, list) and len(parts) == 3):
+        raise ValueError("cursor must be [rank, ts, id]")
+    c_rank, c_ts, c_id = parts
+    if (isinstance(c_rank, bool) or not isinstance(c_rank, (int, float))
+            or not isinstance(c_ts, str)
+            or isinstance(c_id, bool) or not isinstance(c_id, int) or not 0 <= c_id < 2 ** 63):
+        raise ValueError("cursor must be [rank, ts, id]")
+    ts = _parse_iso(c_ts)
+    return float(c_rank), ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc), c_id
+
+def _escape_like(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
 class ConnectionManager:
     MAX_LOGS_PER_ROOM = 1000
+    EXPORT_BATCH_ROWS = 500
+    SEARCH_MIN_LEN = 2
+    SEARCH_MAX_LIMIT = 50
+    # ILIKE '%q%'에서 trigram을 뽑으려면 3글자 이상 필요 (그보다 짧으면 GIN 인덱스로 좁힐 수 없음)
+    SEARCH_TRGM_MIN_LEN = 3
+    # 3글자 미만 검색은 방별 최근 이만큼의 로그만 (room_id, seq) 인덱스로 훑음
+    SEARCH_SHORT_SCAN = int(os.getenv("SEARCH_SHORT_SCAN", "5000"))
+    SYNC_MAX_LIMIT = 100
+    RESUME_MAX_ITEMS = 500
+    READ_FLUSH_INTERVAL = float(os.getenv("READ_FLUSH_INTERVAL", "1.0"))
+    # 휘발성 이벤트: 사용자/방/종류별 최소 전송 간격(초)
+    EPHEMERAL_INTERVALS = {
+        "typing": float(os.getenv("TYPING_INTERVAL", "2.0")),
+        "read_receipt": float(os.getenv("READ_RECEIPT_INTERVAL", "1.0")),
+    }
+    # focus 하지 않은 방의 room_activity 알림: 방별 최소 전송 간격(초), 미리보기 길이
+    ROOM_ACTIVITY_INTERVAL = float(os.getenv("ROOM_ACTIVITY_INTERVAL", "1.0"))
+    ACTIVITY_PREVIEW_LEN = 100
+    # 앱 레벨 heartbeat: 이 시간(초) 동안 조용한 소켓에 ping 이벤트 (0이면 끔)
+    HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "30"))
+    # 이 시간(초) 동안 아무 메시지(pong 포함)도 안 보낸 소켓은 끊음 (0이면 끔)
+    IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", "0"))
+    # 사용자별로 보관하는 오프라인 DM 최대 수 (넘으면 오래된 것부터 버림)
+    OFFLINE_DM_MAX = 100
+    # 종료 시 drain: 연결을 DRAIN_WAVES번에 나눠 DRAIN_WINDOW(초)에 걸쳐 닫고,
+    # close 사유에 0~RECONNECT_JITTER(초) 사이 임의의 재접속 대기 시간을 담음
+    DRAIN_WINDOW = float(os.getenv("DRAIN_WINDOW", "10"))
+    # drain 전에 리스닝 소켓을 열어 둔 채 /readyz 503을 보여주는 시간(초, 로드밸런서가 라우팅에서 뺄 시간)
+    DRAIN_UNREADY_GRACE = float(os.getenv("DRAIN_UNREADY_GRACE", "0"))
+    DRAIN_WAVES = int(os.getenv("DRAIN_WAVES", "10"))
+    RECONNECT_JITTER = float(os.getenv("RECONNECT_JITTER", "30"))
 
     def __init__(self):
-        # 실시간 연결(비영속)
-        self.user_conns: Dict[str, Set[WebSocket]] = defaultdict(set)
-        # 오프라인 DM 큐(메모리만)
-        self.offline_dm: Dict[str, Deque[dict]] = defaultdict(lambda: deque(maxlen=100))
-        self.presence_friend_subs: Dict[str, Set[WebSocket]] = defaultdict(set)
+        # 실시간 연결(비영속): 사용자별 세션 집합
+        self.user_sessions: Dict[str, Set[Session]] = {}
+        # 오프라인 DM 큐(메모리만), 받을 DM이 있는 사용자만 키로 둠 (전달하면 키 삭제)
+        self.offline_dm: Dict[str, Deque[dict]] = {}
+        # 접속 중인 사용자의 방 멤버십 (접속 시 한 번 로드, join/leave 때 갱신, 세션들이 같은 set을 공유)
+        self.user_rooms: Dict[str, Set[str]] = {}
+        self.room_online: Dict[str, Set[str]] = defaultdict(set)
+        # 휘발성 이벤트 전송 창 {(username, room_id, kind): 창 안에서 마지막으로 들어온 payload 또는 None}
+        self._ephemeral_window: Dict[tuple[str, str, str], dict | None] = {}
+        # room_activity 전송 창 {room_id: 창 안에서 마지막 메시지 미리보기 또는 None}
+        self._activity_window: Dict[str, dict | None] = {}
+        # unread 계산용 캐시 (접속 중인 멤버/방만): 방 message_count, (username, room_id) -> read_count
+        self.room_counts: Dict[str, int] = {}
+        self.read_counts: Dict[tuple[str, str], int] = {}
+        # room_focus/room_blur를 한 번이라도 보낸 연결 수 (0이면 room_activity 생략)
+        self.focus_conns = 0
+        self._bg_tasks: Set[asyncio.Task] = set()
+        self.fanout = FanoutScheduler()
+        # True면 새 연결을 받지 않음 (종료 drain 중)
+        self.draining = False
+        # 아직 DB에 기록하지 않은 읽음 포인터 {(username, room_id): last_read_id}
+        self.pending_reads: Dict[tuple[str, str], int] = {}
+        self._read_flush_task: asyncio.Task | None = None
+        self._heartbeat_task: asyncio.Task | None = None
         self.lock = asyncio.Lock()
+        set_send_failure_handler(self._on_send_failure)
 
     # ---------- 연결 관리 ----------
-    async def accept(self, username: str, ws: WebSocket):
-        await ws.accept()
+    async def accept(self, username: str, ws: WebSocket, codec: Codec, subprotocol: str | None = None,
+                     batch_window: float | None = None) -> Session:
+        # 닉네임/방 목록은 사용자의 첫 연결에서만 조회하고 이후 세션은 공유
+        nickname = await self._get_nickname(username)
+        rooms = None if username in self.user_rooms else await self.rooms_of(username)
+        await ws.accept(subprotocol=subprotocol)
+        while True:
+            async with self.lock:
+                if username in self.user_rooms or rooms is not None:
+                    return self._register(username, ws, nickname, codec, rooms, batch_window)
+            # 핸드셰이크 사이에 이전 세션이 모두 끊겨 공유하던 방 목록이 사라짐 -> 다시 조회
+            rooms = await self.rooms_of(username)
+
+    def _register(self, username: str, ws: WebSocket, nickname: str, codec: Codec,
+                  rooms: list | None, batch_window: float | None) -> Session:
+        # self.lock 안에서 호출
+        if username not in self.user_rooms:
+            self.user_rooms[username] = set(rooms)
+            for room_id in self.user_rooms[username]:
+                self.room_online[room_id].add(username)
+        session = Session(ws, username, nickname, codec, self.user_rooms[username])
+        if batch_window:
+            session.batcher = FrameBatcher(ws, codec, batch_window)
+        # ws.state는 처음 접근할 때 연결마다 래퍼 객체를 만들므로 scope에 직접 둠
+        ws.scope[SESSION_SCOPE_KEY] = session
+        self.user_sessions.setdefault(username, set()).add(session)
+        return session
+
+    async def remove(self, session: Session):
         async with self.lock:
-            self.user_conns[username].add(ws)
+            self._detach(session)
+
+    def _detach(self, session: Session) -> bool:
+        # await 없이 한 번에 정리 (remove와 evict 공용)
+        username = session.username
+        sessions = self.user_sessions.get(username)
+        if not sessions or session not in sessions:
+            return False
+        sessions.remove(session)
+        if session.batcher is not None:
+            session.batcher.close()
+        if session.focus is not None:
+            self.focus_conns -= 1
+        if not sessions:
+            self.user_sessions.pop(username, None)
+            for room_id in list(self.user_rooms.get(username, ())):
+                self._index_leave(room_id, username)
+            self.user_rooms.pop(username, None)
+        return True
+
+    def registry_sizes(self) -> dict:
+        """메모리에 들고 있는 구조별 크기 (/debug/memory, soak_test.py가 연결 수와 비교)"""
+        return {
+            "users_online": len(self.user_sessions),
+            "sessions": sum(len(s) for s in self.user_sessions.values()),
+            "presence_subs": sum(1 for s in self._iter_all_sessions() if s.presence_sub),
+            "user_rooms": len(self.user_rooms),
+            "user_room_entries": sum(len(r) for r in self.user_rooms.values()),
+            "room_online": len(self.room_online),
+            "room_counts": len(self.room_counts),
+            "read_counts": len(self.read_counts),
+            "offline_dm_users": len(self.offline_dm),
+            "offline_dm_messages": sum(len(q) for q in self.offline_dm.values()),
+            "ephemeral_windows": len(self._ephemeral_window),
+            "activity_windows": len(self._activity_window),
+            "pending_reads": len(self.pending_reads),
+            "bg_tasks": len(self._bg_tasks),
+            "fanout_room_stats": len(self.fanout.room_stats),
+        }
+
+    def _iter_all_sessions(self) -> List[Session]:
+        return [s for sessions in self.user_sessions.values() for s in sessions]
+
+    # ---------- 죽은 연결 정리 ----------
+    def _on_send_failure(self, ws: WebSocket, exc: BaseException):
+        session = _session_of(ws)
+        if session is not None:
+            self.evict(session, "send_timeout" if isinstance(exc, TimeoutError) else "send_error")
+
+    def evict(self, session: Session, reason: str):
+        # 연결 목록에서 바로 빼서 이후 fan-out 대상에서 제외하고, 소켓 닫기는 백그라운드로
+        # (수신 루프는 close 후 disconnect를 받아 finally에서 offline presence 처리)
+        if not self._detach(session):
+            return
+        ws_reaped.inc(reason=reason)
+        self._spawn(self._close_evicted(session.ws))
 
-    async def remove(self, username: str, ws: WebSocket):
-        async with self.lock:
-            conns = self.user_conns.get(username)
-            if conns and ws in conns:
-                conns.remove(ws)
-                if not conns:
-                    self.user_conns.pop(username, None)
+    async def _close_evicted(self, ws: WebSocket):
+        try:
+            async with asyncio.timeout(SEND_TIMEOUT):
+                await ws.close(code=status.WS_1011_INTERNAL_ERROR)
+        except Exception:
+            pass
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            quiet = []
+            for session in self._iter_all_sessions():
+                idle = now - session.last_seen
+                if self.IDLE_TIMEOUT and idle > self.IDLE_TIMEOUT:
+                    self.evict(session, "idle")
+                elif idle >= self.HEARTBEAT_INTERVAL:
+                    quiet.append(session)
+            # 전송 실패/타임아웃 소켓은 send failure 핸들러가 바로 정리
+            await self.fanout.send(iter(quiet), _evt("ping"))
+
+    def _index_join(self, room_id: str, username: str):
+        rooms = self.user_rooms.get(username)
+        if rooms is not None:  # 접속 중인 사용자만
+            rooms.add(room_id)
+            self.room_online[room_id].add(username)
+
+    def _index_leave(self, room_id: str, username: str):
+        rooms = self.user_rooms.get(username)
+        if rooms is not None:
+            rooms.discard(room_id)
+        self.read_counts.pop((username, room_id), None)
+        online = self.room_online.get(room_id)
+        if online is not None:
+            online.discard(username)
+            if not online:
+                self.room_online.pop(room_id, None)
+                self.room_counts.pop(room_id, None)
+
+    def set_focus(self, session: Session, room_id: str, focused: bool):
+        # 처음 호출되는 순간 그 연결은 focus 모드로 바뀜 (focus 중인 방만 전체 메시지)
+        if session.focus is None:
+            session.focus = set()
+            self.focus_conns += 1
+        if focused:
+            session.focus.add(room_id)
+        else:
+            session.focus.discard(room_id)
 
     async def is_online(self, username: str) -> bool:
         async with self.lock:
-            return bool(self.user_conns.get(username))
+            return bool(self.user_sessions.get(username))
 
     # ---------- 사용자 관리 ----------
     async def register_user(self, username: str, password: str = "default", nickname: str = "") -> str:
         if not username:
             return "INVALID"
         
+        # 조회 후 INSERT 대신 PK 충돌로 판단 -> 동시 가입 경쟁에도 한 쪽만 CREATED
+        stmt = (
+            pg_insert(User)
+            .values(username=username, password=password, nickname=nickname or username, created_at=now_utc())
+            .on_conflict_do_nothing(index_elements=[User.username])
+            .returning(User.username)
+        )
         async with get_db() as db:
-            # 기존 사용자 확인
-            result = await db.execute(select(User).where(User.username == username))
-            existing = result.scalar_one_or_none()
-            
-            if existing:
-                return "ALREADY"
-            
-            # 새 사용자 생성
-            new_user = User(
-                username=username,
-                password=password,
-                nickname=nickname or username
-            )
-            db.add(new_user)
-            await db.commit()
-            return "CREATED"
+            result = await db.execute(stmt)
+            return "CREATED" if result.scalar_one_or_none() else "ALREADY"
 
     async def verify_credentials(self, username: str, password: str) -> str:
         async with get_db() as db:
@@ -141,8 +536,8 @@ class ConnectionManager:
 
     async def get_user_info(self, username: str) -> Optional[UserInfo]:
         async with get_db() as db:
-            result = await db.execute(select(User).where(User.username == username))
-            user = result.scalar_one_or_none()
+            result = await db.execute(queries.USER_BY_NAME, {"username": username})
+            user = result.one_or_none()
             
             if not user:
                 return None
@@ -155,113 +550,134 @@ class ConnectionManager:
             )
 
     async def _get_nickname(self, username: str) -> str:
-        user_info = await self.get_user_info(username)
+        # 접속 중이면 접속 시 조회해 둔 닉네임 사용
+        for session in self.user_sessions.get(username, ()):
+            return session.nickname
+        with tracing.span("get_nickname", user=username):
+            user_info = await self.get_user_info(username)
         return user_info.nickname if user_info and user_info.nickname else username
 
     # ---------- 채팅방 관리 ----------
     def _gen_room_id(self) -> str:
         return "r_" + secrets.token_hex(4)
 
-    async def _ensure_room_by_id(self, room_id: str, name: str | None = None, db: AsyncSession = None):
-        close_db_after = False
-        if db is None:
-            db = AsyncSessionLocal()
-            close_db_after = True
-        
-        try:
-            result = await db.execute(select(Room).where(Room.id == room_id))
-            existing = result.scalar_one_or_none()
-            
-            if not existing:
-                new_room = Room(
-                    id=room_id,
-                    name=name or room_id,
-                    created_at=now_utc()
-                )
-                db.add(new_room)
-                await db.commit()
-        finally:
-            if close_db_after:
-                await db.close()
-
     async def _find_room_id_by_name(self, name: str) -> str | None:
         async with get_db() as db:
             result = await db.execute(select(Room).where(Room.name == name))
             room = result.scalar_one_or_none()
             return room.id if room else None
 
-    async def _update_room_last(self, room_id: str, entry: dict):
-        if entry.get("kind") == "dm":
-            return
-        
-        async with get_db() as db:
-            result = await db.execute(select(Room).where(Room.id == room_id))
-            room = result.scalar_one_or_none()
-            
-            if room:
-                room.last_message_text = entry.get("text")
-                room.last_message_from = entry.get("from")
-                room.last_message_kind = entry.get("kind")
-                room.last_message_ts = _parse_iso(entry.get("ts")) if entry.get("ts") else now_utc()
-                await db.commit()
+    async def _advance_room(self, db: AsyncSession, room_id: str, entry: dict) -> tuple[int, int] | None:
+        # 로그 INSERT와 같은 트랜잭션에서 호출
+        # 방 행을 잠그고 seq 발급 -> 같은 방의 append는 커밋까지 직렬화되어 seq에 빈틈/역전이 없음
+        values_ = {"last_seq": Room.last_seq + 1}
+        if entry.get("kind") != "dm":
+            # 방의 마지막 메시지 / 메시지 수 업데이트
+            values_.update(
+                last_message_text=entry.get("text"),
+                last_message_from=entry.get("from"),
+                last_message_kind=entry.get("kind"),
+                last_message_ts=_parse_iso(entry.get("ts")) if entry.get("ts") else now_utc(),
+                message_count=Room.message_count + 1
+            )
+        with tracing.span("advance_room", room=room_id):
+            result = await db.execute(
+                update(Room).where(Room.id == room_id).values(**values_).returning(Room.last_seq, Room.message_count)
+            )
+        return result.one_or_none()
 
     async def create_room(self, name: str, creator: str) -> dict:
-        rid = self._gen_room_id()
-        
-        async with get_db() as db:
-            new_room = Room(
-                id=rid,
-                name=name,
-                created_at=now_utc()
+        creator_nickname = await self._get_nickname(creator)
+        text_ = f'대화방 "{name}"을 {creator_nickname} 님이 만들었습니다'
+        created_at = now_utc()
+        # 방 INSERT와 생성 시스템 로그(seq=1)를 한 문장으로
+        # 랜덤 id가 겹치면 ON CONFLICT로 로그도 안 들어가므로 다른 id로 다시 시도
+        for _ in range(3):
+            rid = self._gen_room_id()
+            new_room = (
+                pg_insert(Room)
+                .values(id=rid, name=name, created_at=created_at, last_seq=1, message_count=1,
+                        last_message_text=text_, last_message_from="system", last_message_kind="system",
+                        last_message_ts=created_at)
+                .on_conflict_do_nothing(index_elements=[Room.id])
+                .returning(Room.id)
+                .cte("new_room")
             )
-            db.add(new_room)
-            await db.commit()
-            
-            creator_nickname = await self._get_nickname(creator)
-            await self._append_log(
-                rid, 
-                kind="system", 
-                text=f'대화방 "{name}"을 {creator_nickname} 님이 만들었습니다',
-                from_user="system",
-                from_nickname="system"
+            log_cols = select(
+                new_room.c.id, literal(created_at, DateTime(timezone=True)), literal(1), literal("system"),
+                literal("system"), literal("system"), literal(text_)
             )
-            
-            return {
-                "id": rid,
-                "name": name,
-                "created_at": new_room.created_at.isoformat()
-            }
+            stmt = (
+                insert(ChatLog)
+                .from_select(["room_id", "ts", "seq", "kind", "from_user", "from_nickname", "text"], log_cols)
+                .returning(ChatLog.id)
+                .add_cte(new_room)
+            )
+            async with get_db() as db:
+                result = await db.execute(stmt)
+                if result.scalar_one_or_none() is not None:
+                    return {
+                        "id": rid,
+                        "name": name,
+                        "created_at": created_at.isoformat()
+                    }
+        raise RuntimeError("room id collision")
 
     async def rooms_summary(self, username: str) -> List[dict]:
-        async with get_db() as db:
+        # 버퍼에 남은 내 읽음 포인터부터 반영
+        await self.flush_read_pointers(username)
+
+        async with get_db(read_only=True) as db:
             # 사용자가 속한 방들 조회
-            stmt = (
-                select(Room)
-                .join(RoomMember, Room.id == RoomMember.room_id)
-                .where(RoomMember.username == username)
-                .order_by(desc(Room.last_message_ts))
+            result = await db.execute(queries.ROOMS_SUMMARY, {"username": username})
+            rows = result.all()
+            
+            return [_room_item(row, row.last_read_id, row.read_count) for row in rows]
+
+    async def initial_sync(self, username: str, limit: int = 20, since: Dict[str, int] | None = None) -> List[dict]:
+        """방 목록 + 방별 최근 limit개 로그를 LATERAL 쿼리 한 번으로 조회
+        since = {room_id: 마지막으로 받은 로그 id} 이면 그 이후 로그만"""
+        limit = max(1, min(limit, self.SYNC_MAX_LIMIT))
+        await self.flush_read_pointers(username)
+
+        recent = select(ChatLog).where(ChatLog.room_id == Room.id).where(_visible_to(username))
+        cursors = None
+        if since:
+            cursors = (
+                values(column("room_id", String), column("since_id", Integer), name="cursors")
+                .data([(rid, int(sid)) for rid, sid in since.items()])
             )
+            recent = recent.where(ChatLog.id > func.coalesce(cursors.c.since_id, 0))
+        recent = recent.order_by(ChatLog.seq.desc()).limit(limit).lateral("recent")
+        log = aliased(ChatLog, recent)
+
+        stmt = (
+            select(Room, RoomMember.last_read_id, RoomMember.read_count, log)
+            .join(RoomMember, Room.id == RoomMember.room_id)
+        )
+        if cursors is not None:
+            stmt = stmt.outerjoin(cursors, cursors.c.room_id == Room.id)
+        stmt = (
+            stmt.outerjoin(recent, true())
+            .where(RoomMember.username == username)
+            .order_by(desc(Room.last_message_ts), Room.id, log.seq)
+        )
+
+        async with get_db() as db:
             result = await db.execute(stmt)
-            rooms = result.scalars().all()
-            
-            items = []
-            for room in rooms:
-                last_info = None
-                if room.last_message_text:
-                    last_info = {
-                        "text": room.last_message_text,
-                        "from": room.last_message_from,
-                        "kind": room.last_message_kind,
-                        "ts": room.last_message_ts.isoformat() if room.last_message_ts else None
-                    }
-                
-                items.append({
-                    "id": room.id,
-                    "name": room.name,
-                    "last": last_info
-                })
-            
-            return items
+            rows = result.all()
+
+        rooms: Dict[str, dict] = {}
+        for room, last_read_id, read_count, entry in rows:
+            item = rooms.get(room.id)
+            if item is None:
+                item = rooms[room.id] = {**_room_item(room, last_read_id, read_count), "items": []}
+            if entry is not None:
+                item["items"].append(_log_item(entry))
+        for item in rooms.values():
+            # limit개가 꽉 찼으면 그 이전 로그가 더 있을 수 있음 -> history로 이어받기
+            item["has_more"] = len(item["items"]) >= limit
+        return list(rooms.values())
 
     async def join_or_create_by_name(self, name: str, username: str) -> str:
         rid = await self._find_room_id_by_name(name)
@@ -272,35 +688,49 @@ class ConnectionManager:
         return rid
 
     async def join_room_by_id(self, room_id: str, username: str) -> bool:
-        async with get_db() as db:
-            await self._ensure_room_by_id(room_id, db=db)
-            
-            # 이미 멤버인지 확인
-            result = await db.execute(
-                select(RoomMember).where(
-                    and_(RoomMember.room_id == room_id, RoomMember.username == username)
-                )
+        # 방이 없으면 만들고 멤버 INSERT까지 한 문장 (이미 멤버면 idx_room_member 충돌로 아무것도 안 함)
+        # CTE 안의 INSERT에는 컬럼 Python default가 적용되지 않으므로 값을 모두 명시
+        new_room = (
+            pg_insert(Room)
+            .values(id=room_id, name=room_id, created_at=now_utc(), message_count=0, last_seq=0)
+            .on_conflict_do_nothing(index_elements=[Room.id])
+            .cte("new_room")
+        )
+        stmt = (
+            pg_insert(RoomMember)
+            .values(
+                room_id=room_id,
+                username=username,
+                joined_at=now_utc(),
+                last_read_id=0,
+                # 입장 전 메시지는 읽은 것으로 간주 (같은 문장에서 새로 만든 방은 안 보이므로 0)
+                read_count=func.coalesce(select(Room.message_count).where(Room.id == room_id).scalar_subquery(), 0)
             )
-            existing = result.scalar_one_or_none()
-            
-            if existing:
+            .on_conflict_do_nothing(index_elements=[RoomMember.room_id, RoomMember.username])
+            .returning(RoomMember.id)
+            .add_cte(new_room)
+        )
+        async with get_db() as db:
+            result = await db.execute(stmt)
+            if result.scalar_one_or_none() is None:
                 return False
-            
-            # 새 멤버 추가
-            new_member = RoomMember(room_id=room_id, username=username)
-            db.add(new_member)
-            await db.commit()
-            
-            nickname = await self._get_nickname(username)
-            await self._append_log(
-                room_id,
-                kind="system",
-                text=f"{nickname} 님이 입장하셨습니다",
-                from_user="system",
-                from_nickname="system"
-            )
-            
-            return True
+        async with self.lock:
+            self._index_join(room_id, username)
+        
+        nickname = await self._get_nickname(username)
+        entry = await self._append_log(
+            room_id,
+            kind="system",
+            text=f"{nickname} 님이 입장하셨습니다",
+            from_user="system",
+            from_nickname="system"
+        )
+        # 자기 입장 로그는 읽은 것으로 처리 (보낸 사람과 같게, 안 하면 새 멤버마다 unread 1)
+        self.mark_read(username, room_id, entry["id"])
+        if room_id in self.room_counts and self.in_room(username, room_id):
+            self.read_counts[(username, room_id)] = self.room_counts[room_id]
+        
+        return True
 
     async def leave_room_by_id(self, room_id: str, username: str):
         nickname = await self._get_nickname(username)
@@ -311,7 +741,8 @@ class ConnectionManager:
                     and_(RoomMember.room_id == room_id, RoomMember.username == username)
                 )
             )
-            await db.commit()
+        async with self.lock:
+            self._index_leave(room_id, username)
         
         await self._append_log(
             room_id,
@@ -321,26 +752,58 @@ class ConnectionManager:
             from_nickname="system"
         )
 
+    async def is_member(self, room_id: str, username: str) -> bool:
+        async with get_db() as db:
+            result = await db.execute(queries.IS_MEMBER, {"room": room_id, "username": username})
+            return result.scalar_one_or_none() is not None
+
     async def rooms_of(self, username: str) -> List[str]:
         async with get_db() as db:
-            result = await db.execute(
-                select(RoomMember.room_id).where(RoomMember.username == username)
-            )
+            result = await db.execute(queries.ROOMS_OF, {"username": username})
             return [row[0] for row in result.all()]
 
     # ---------- 메시지 관리 ----------
-    async def _targets_in_room(self, room_id: str) -> List[WebSocket]:
-        async with get_db() as db:
-            result = await db.execute(
-                select(RoomMember.username).where(RoomMember.room_id == room_id)
-            )
-            members = [row[0] for row in result.all()]
-        
-        async with self.lock:
-            targets: List[WebSocket] = []
-            for u in members:
-                targets.extend(self.user_conns.get(u, []))
-            return targets
+    async def _targets_in_room(self, room_id: str, exclude: str | None = None,
+                               focused: bool | None = None, local: bool = False) -> Iterator[Session]:
+        # 멤버 목록은 DB 기준: room_online은 이 프로세스에서 한 가입/탈퇴만 반영하므로
+        # 다른 노드에서 가입한 사용자의 이 노드 연결도 받도록 (local=True면 휘발성 이벤트용으로 인덱스만 사용)
+        # 멤버는 FANOUT_CHUNK_SIZE개씩 받아 여기 연결이 있는 사용자만 남기고, 소켓은 fan-out이 청크 단위로 꺼내감
+        with tracing.span("targets_in_room", room=room_id, local=local) as sp:
+            if local:
+                async with self.lock:
+                    members = [u for u in self.room_online.get(room_id, ()) if u != exclude]
+            else:
+                members = [u for u in await self._connected_members(room_id) if u != exclude]
+            sp.set(members=len(members))
+        return self._iter_sessions(members, room_id, focused)
+
+    async def _connected_members(self, room_id: str) -> List[str]:
+        # room_members를 FANOUT_CHUNK_SIZE개씩 받아 이 프로세스에 연결이 있는 사용자만 남김
+        # 커밋된 쓰기의 fan-out이므로 요청 마감을 적용하지 않음 (TIMEOUT인데 저장된 메시지가 생기지 않게)
+        token = op_deadline.set(None)
+        try:
+            async with get_db() as db:
+                result = await db.stream_scalars(
+                    queries.ROOM_MEMBERS.execution_options(yield_per=self.fanout.chunk_size),
+                    {"room": room_id},
+                )
+                return [u async for u in result if u in self.user_sessions]
+        finally:
+            op_deadline.reset(token)
+
+    def _iter_sessions(self, usernames: List[str], room_id: str | None = None,
+                       focused: bool | None = None) -> Iterator[Session]:
+        # focused: None=모든 연결, True=이 방을 보고 있는 연결(focus 미사용 포함), False=그 외
+        for u in usernames:
+            # 사용자별 세션 집합은 꺼내는 순간 복사 (청크 사이 await 동안 바뀔 수 있음)
+            for session in tuple(self.user_sessions.get(u, ())):
+                if focused is None or session.is_focused(room_id) == focused:
+                    yield session
+
+    async def broadcast_room(self, room_id: str, payload: dict, exclude: str | None = None,
+                             focused: bool | None = None, local: bool = False):
+        targets = await self._targets_in_room(room_id, exclude=exclude, focused=focused, local=local)
+        await self.fanout.send(targets, payload, room_id=room_id)
 
     async def _append_log(
         self,
@@ -350,34 +813,52 @@ class ConnectionManager:
         from_user: str,
         from_nickname: str = "",
         to_user: Optional[str] = None
-    ):
-        async with get_db() as db:
-            new_log = ChatLog(
-                room_id=room_id,
-                ts=now_utc(),
-                kind=kind,
-                from_user=from_user,
-                from_nickname=from_nickname or from_user,
-                to_user=to_user,
-                text=text
-            )
-            db.add(new_log)
-            await db.commit()
-            
-            # 방의 마지막 메시지 업데이트
-            entry = {
-                "ts": new_log.ts.isoformat(),
-                "kind": kind,
-                "from": from_user,
-                "text": text
-            }
-            await self._update_room_last(room_id, entry)
-
-    async def broadcast_room_message(self, room_id: str, from_user: str, text: str, from_nickname: str = ""):
-        await self._append_log(room_id, kind="msg", text=text, from_user=from_user, from_nickname=from_nickname)
-        targets = await self._targets_in_room(room_id)
-        payload = _evt("message", room=room_id, **{"from": from_user}, from_nickname=from_nickname, text=text)
-        await _send_json_many(targets, payload)
+    ) -> dict:
+        with tracing.span("append_log", room=room_id, kind=kind):
+            async with get_db() as db:
+                entry = {
+                    "ts": now_utc().isoformat(),
+                    "kind": kind,
+                    "from": from_user,
+                    "text": text
+                }
+                advanced = await self._advance_room(db, room_id, entry)
+                entry["seq"], message_count = advanced if advanced else (None, None)
+
+                new_log = ChatLog(
+                    room_id=room_id,
+                    ts=_parse_iso(entry["ts"]),
+                    seq=entry["seq"],
+                    kind=kind,
+                    from_user=from_user,
+                    from_nickname=from_nickname or from_user,
+                    to_user=to_user,
+                    text=text
+                )
+                db.add(new_log)
+                await db.flush()
+                entry["id"] = new_log.id
+            if message_count is not None and room_id in self.room_online:
+                # 동시 append의 커밋 순서가 뒤바뀌어도 줄어들지 않게
+                self.room_counts[room_id] = max(message_count, self.room_counts.get(room_id, 0))
+            return entry
+
+    async def broadcast_room_message(self, room_id: str, from_user: str, text: str, from_nickname: str = "") -> dict:
+        entry = await self._append_log(room_id, kind="msg", text=text, from_user=from_user, from_nickname=from_nickname)
+        # 보낸 사람은 자기 메시지까지 읽은 것으로 처리
+        self.mark_read(from_user, room_id, entry["id"])
+        if room_id in self.room_counts and self.in_room(from_user, room_id):
+            self.read_counts[(from_user, room_id)] = self.room_counts[room_id]
+        payload = _evt("message", room=room_id, **{"from": from_user}, from_nickname=from_nickname, text=text,
+                       id=entry["id"], seq=entry["seq"])
+        # 전체 메시지는 이 방을 보고 있는 연결에만, 나머지는 room_activity 알림
+        await self.broadcast_room(room_id, payload, focused=True)
+        if self.focus_conns:
+            self.publish_activity(room_id, {
+                "id": entry["id"], "seq": entry["seq"], "from": from_user, "from_nickname": from_nickname,
+                "text": text[:self.ACTIVITY_PREVIEW_LEN], "ts": payload["ts"],
+            })
+        return entry
 
     async def dm_in_room(self, room_id: str, from_user: str, to_user: str, text: str, from_nickname: str = "") -> str:
         async with get_db() as db:
@@ -398,104 +879,391 @@ class ConnectionManager:
             if not recipient_result.scalar_one_or_none():
                 return "RECIPIENT_NOT_IN_ROOM"
         
-        await self._append_log(room_id, kind="dm", text=text, from_user=from_user, to_user=to_user, from_nickname=from_nickname)
+        entry = await self._append_log(room_id, kind="dm", text=text, from_user=from_user, to_user=to_user, from_nickname=from_nickname)
         
         async with self.lock:
-            sockets = list(self.user_conns.get(to_user, []))
+            sessions = list(self.user_sessions.get(to_user, []))
         
-        payload = _evt("dm", room=room_id, **{"from": from_user}, from_nickname=from_nickname, to=to_user, text=text)
-        if sockets:
-            await _send_json_many(sockets, payload)
+        payload = _evt("dm", room=room_id, **{"from": from_user}, from_nickname=from_nickname, to=to_user, text=text,
+                       id=entry["id"], seq=entry["seq"])
+        if sessions:
+            await _send_many(sessions, payload)
             return "DELIVERED"
         
         async with self.lock:
-            self.offline_dm[to_user].append({
+            self.offline_dm.setdefault(to_user, deque(maxlen=self.OFFLINE_DM_MAX)).append({
                 "room": room_id,
                 "from": from_user,
                 "from_nickname": from_nickname,
                 "text": text,
-                "ts": now_utc().isoformat()
+                "ts": now_utc().isoformat(),
+                "id": entry["id"],
+                "seq": entry["seq"]
             })
         return "QUEUED"
 
     async def flush_offline(self, username: str, nickname: str = ""):
         async with self.lock:
-            q = self.offline_dm.get(username)
-            if not q or not len(q):
+            q = self.offline_dm.pop(username, None)
+            if not q:
                 return
             items = list(q)
-            q.clear()
-            sockets = list(self.user_conns.get(username, []))
+            sessions = list(self.user_sessions.get(username, []))
         
-        if not sockets:
+        if not sessions:
             async with self.lock:
-                self.offline_dm[username].extend(items)
+                # 그 사이 새로 쌓인 DM은 뒤로 (최신 OFFLINE_DM_MAX개 유지)
+                q.extend(self.offline_dm.get(username, ()))
+                self.offline_dm[username] = q
             return
         
         await asyncio.gather(*(
-            _send_json_many(
-                sockets,
-                _evt("offline_dm", room=it["room"], **{"from": it["from"]}, from_nickname=it.get("from_nickname", it["from"]), text=it["text"], at=it["ts"])
+            _send_many(
+                sessions,
+                _evt("offline_dm", room=it["room"], **{"from": it["from"]}, from_nickname=it.get("from_nickname", it["from"]), text=it["text"], at=it["ts"],
+                     id=it.get("id"), seq=it.get("seq"))
             )
             for it in items
         ), return_exceptions=True)
 
     async def get_history(self, room_id: str, limit: int = 50, before: str | None = None, after: str | None = None) -> list[dict]:
-        async with get_db() as db:
-            stmt = select(ChatLog).where(ChatLog.room_id == room_id)
-            
-            if after:
-                stmt = stmt.where(ChatLog.ts > _parse_iso(after))
-            if before:
-                stmt = stmt.where(ChatLog.ts < _parse_iso(before))
-            
-            stmt = stmt.order_by(ChatLog.ts.desc()).limit(limit)
-            result = await db.execute(stmt)
-            logs = result.scalars().all()
+        params = {"room": room_id, "limit": limit}
+        if after:
+            params["after"] = _parse_iso(after)
+        if before:
+            params["before"] = _parse_iso(before)
+        
+        async with get_db(read_only=True) as db:
+            result = await db.execute(queries.HISTORY[bool(after), bool(before)], params)
+            logs = result.all()
             
             # 최신순으로 가져왔으니 역순으로 변환
             logs = list(reversed(logs))
             
-            return [
-                {
-                    "ts": log.ts.isoformat(),
-                    "kind": log.kind,
-                    "room": log.room_id,
-                    "from": log.from_user,
-                    "from_nickname": log.from_nickname,
-                    "text": log.text,
-                    **({"to": log.to_user} if log.to_user else {})
-                }
-                for log in logs
-            ]
+            return [_log_item(log) for log in logs]
+
+    async def resume(self, username: str, last_seqs: Dict[str, int]) -> Dict[str, dict]:
+        """방별 마지막으로 받은 seq 이후 로그를 한 번에 조회 (LATERAL, 방당 최대 RESUME_MAX_ITEMS)
+        seq는 DM 포함 방 로그 전체에 매기므로 당사자가 아닌 DM 자리는 빈 번호로 남음 (last_seq까지 받으면 누락 없음)"""
+        if not last_seqs:
+            return {}
+        cursors = (
+            values(column("room_id", String), column("last_seq", Integer), name="cursors")
+            .data([(rid, int(seq)) for rid, seq in last_seqs.items()])
+        )
+        missed = (
+            select(ChatLog)
+            .where(and_(ChatLog.room_id == cursors.c.room_id, ChatLog.seq > cursors.c.last_seq))
+            .where(_visible_to(username))
+            .order_by(ChatLog.seq)
+            .limit(self.RESUME_MAX_ITEMS + 1)
+            .lateral("missed")
+        )
+        log = aliased(ChatLog, missed)
+        stmt = (
+            select(Room.id, Room.last_seq, log)
+            .select_from(cursors)
+            .join(Room, Room.id == cursors.c.room_id)
+            .join(RoomMember, and_(RoomMember.room_id == Room.id, RoomMember.username == username))
+            .outerjoin(missed, true())
+            .order_by(Room.id, log.seq)
+        )
+        async with get_db() as db:
+            result = await db.execute(stmt)
+            rows = result.all()
+
+        rooms: Dict[str, dict] = {}
+        for room_id, last_seq, entry in rows:
+            item = rooms.setdefault(room_id, {"last_seq": last_seq, "items": [], "complete": True})
+            if entry is None:
+                continue
+            if len(item["items"]) >= self.RESUME_MAX_ITEMS:
+                # 너무 많이 밀림 -> 클라이언트는 history로 다시 받아야 함
+                item["complete"] = False
+                continue
+            item["items"].append(_log_item(entry))
+        return rooms
+
+    async def iter_room_export(self, room_id: str, since: int = 0, viewer: str | None = None) -> AsyncIterator[bytes]:
+        # 서버사이드 커서로 EXPORT_BATCH_ROWS씩 읽어 NDJSON 청크로 반환
+        # StreamingResponse가 클라이언트 전송을 기다린 뒤 다음 청크를 요청하므로
+        # 느린 클라이언트에서는 커서 fetch도 함께 멈춘다 (메모리 일정)
+        # viewer가 있으면 그 사용자가 당사자인 DM만 (None이면 전체)
+        stmt = (
+            select(ChatLog.id, ChatLog.seq, ChatLog.ts, ChatLog.kind, ChatLog.room_id, ChatLog.from_user,
+                   ChatLog.from_nickname, ChatLog.to_user, ChatLog.text)
+            .where(and_(ChatLog.room_id == room_id, ChatLog.id > since))
+            .order_by(ChatLog.id)
+            .execution_options(yield_per=self.EXPORT_BATCH_ROWS)
+        )
+        if viewer is not None:
+            stmt = stmt.where(_visible_to(viewer))
+        async with read_bind().connect() as conn:
+            async with conn.stream(stmt) as result:
+                async for rows in result.partitions():
+                    yield "".join(
+                        json.dumps(_log_item(row), ensure_ascii=False) + "\n" for row in rows
+                    ).encode("utf-8")
+
+    async def search_messages(
+        self,
+        username: str,
+        q: str,
+        room_id: str | None = None,
+        limit: int = 20,
+        cursor: str | None = None
+    ) -> tuple[list[dict], str | None]:
+        """내가 속한 방의 메시지 검색. (rank, ts, id) 내림차순 키셋 페이지네이션
+        SEARCH_TRGM_MIN_LEN보다 짧은 검색어(한국어 두 글자 단어 등)는 방별 최근 SEARCH_SHORT_SCAN개 로그에서만 찾음"""
+        limit = max(1, min(limit, self.SEARCH_MAX_LIMIT))
+        # 잘못된 커서는 SQL을 만들기 전에 ValueError
+        after_key = _decode_cursor(cursor) if cursor else None
+        # real -> double precision: 커서로 돌려받은 값과 정확히 비교되도록
+        rank = cast(func.word_similarity(q, ChatLog.text), Float)
+
+        stmt = (
+            select(ChatLog, rank.label("rank"))
+            .join(RoomMember, and_(RoomMember.room_id == ChatLog.room_id, RoomMember.username == username))
+            .where(ChatLog.text.ilike(f"%{_escape_like(q)}%", escape="\\"))
+            .where(_visible_to(username))
+        )
+        if len(q) < self.SEARCH_TRGM_MIN_LEN:
+            stmt = (
+                stmt.join(Room, Room.id == ChatLog.room_id)
+                .where(ChatLog.seq > Room.last_seq - self.SEARCH_SHORT_SCAN)
+            )
+        if room_id:
+            stmt = stmt.where(ChatLog.room_id == room_id)
+        if after_key:
+            c_rank, c_ts, c_id = after_key
+            stmt = stmt.where(or_(
+                rank < c_rank,
+                and_(rank == c_rank, tuple_(ChatLog.ts, ChatLog.id) < tuple_(c_ts, c_id))
+            ))
+        stmt = stmt.order_by(desc("rank"), ChatLog.ts.desc(), ChatLog.id.desc()).limit(limit + 1)
+
+        async with get_db(read_only=True) as db:
+            result = await db.execute(stmt)
+            rows = result.all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last, last_rank = rows[-1]
+            next_cursor = _encode_cursor(last_rank, last.ts.isoformat(), last.id)
+        return [{**_log_item(log), "rank": r} for log, r in rows], next_cursor
+
+    # ---------- 휘발성 이벤트 (typing, read_receipt) ----------
+    # DB를 전혀 거치지 않고 메모리의 멤버십/연결 정보만 사용
+    def in_room(self, username: str, room_id: str) -> bool:
+        return room_id in self.user_rooms.get(username, ())
+
+    def publish_ephemeral(self, username: str, room_id: str, kind: str, payload: dict):
+        # 창이 열려있으면(interval 안에 이미 보냄) 최신 payload만 남기고,
+        # 창이 닫힐 때 마지막 것을 한 번 보냄 -> 사용자/방/종류별 interval당 최대 1회
+        key = (username, room_id, kind)
+        if key in self._ephemeral_window:
+            self._ephemeral_window[key] = payload
+            return
+        self._ephemeral_window[key] = None
+        self._spawn(self._deliver_ephemeral(username, room_id, payload))
+        asyncio.get_running_loop().call_later(self.EPHEMERAL_INTERVALS[kind], self._close_ephemeral_window, key)
+
+    def _close_ephemeral_window(self, key: tuple[str, str, str]):
+        payload = self._ephemeral_window.pop(key, None)
+        if payload is not None:
+            self.publish_ephemeral(*key, payload)
+
+    async def _deliver_ephemeral(self, username: str, room_id: str, payload: dict):
+        await self.broadcast_room(room_id, payload, exclude=username, focused=True, local=True)
+
+    # ---------- room_activity (focus 하지 않은 방) ----------
+    def publish_activity(self, room_id: str, last: dict):
+        # publish_ephemeral과 같은 방식: 방별 interval당 최대 1회, 창 안의 마지막 메시지 기준
+        if room_id in self._activity_window:
+            self._activity_window[room_id] = last
+            return
+        self._activity_window[room_id] = None
+        self._spawn(self._deliver_activity(room_id, last))
+        asyncio.get_running_loop().call_later(self.ROOM_ACTIVITY_INTERVAL, self._close_activity_window, room_id)
+
+    def _close_activity_window(self, room_id: str):
+        last = self._activity_window.pop(room_id, None)
+        if last is not None:
+            self.publish_activity(room_id, last)
+
+    async def _deliver_activity(self, room_id: str, last: dict):
+        members = [u for u in await self._connected_members(room_id)
+                   if any(not s.is_focused(room_id) for s in self.user_sessions.get(u, ()))]
+        if not members:
+            return
+        unread = await self._unread_counts(room_id, members)
+        # unread가 같은 사용자끼리 묶어서 payload 인코딩은 그룹당 한 번
+        groups: Dict[int, List[str]] = defaultdict(list)
+        for u in members:
+            groups[unread[u]].append(u)
+        for count, users in groups.items():
+            payload = _evt("room_activity", room=room_id, unread=count, last=last)
+            await self.fanout.send(self._iter_sessions(users, room_id, focused=False), payload, room_id=room_id)
+
+    async def _unread_counts(self, room_id: str, usernames: List[str]) -> Dict[str, int]:
+        # unread = 방 message_count - 멤버 read_count, 캐시에 없는 것만 DB에서 한 번에 조회
+        total = self.room_counts.get(room_id)
+        missing = [u for u in usernames if (u, room_id) not in self.read_counts]
+        rows = []
+        if total is None or missing:
+            async with get_db() as db:
+                if total is None:
+                    result = await db.execute(select(Room.message_count).where(Room.id == room_id))
+                    total = result.scalar_one_or_none() or 0
+                if missing:
+                    result = await db.execute(
+                        select(RoomMember.username, RoomMember.read_count).where(
+                            and_(RoomMember.room_id == room_id, RoomMember.username.in_(missing))
+                        )
+                    )
+                    rows = result.all()
+            async with self.lock:
+                if room_id in self.room_online:
+                    self.room_counts[room_id] = max(total, self.room_counts.get(room_id, 0))
+                    for u, read_count in rows:
+                        if u in self.room_online[room_id]:
+                            self.read_counts.setdefault((u, room_id), read_count)
+            total = self.room_counts.get(room_id, total)
+        return {u: max(0, total - self.read_counts.get((u, room_id), total)) for u in usernames}
+
+    def _spawn(self, coro):
+        # 요청 처리 중에 띄운 백그라운드 작업은 그 요청의 마감 시각을 물려받지 않음
+        ctx = contextvars.copy_context()
+        ctx.run(op_deadline.set, None)
+        task = asyncio.create_task(coro, context=ctx)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
+
+    # ---------- 읽음 포인터 ----------
+    def mark_read(self, username: str, room_id: str, last_read_id: int):
+        # 바로 쓰지 않고 버퍼에 최댓값만 남김 -> 빠른 스크롤도 주기당 1회 UPDATE
+        key = (username, room_id)
+        if last_read_id > self.pending_reads.get(key, 0):
+            self.pending_reads[key] = last_read_id
+
+    async def flush_read_pointers(self, username: str | None = None):
+        if username is None:
+            batch = self.pending_reads
+            self.pending_reads = {}
+        else:
+            batch = {k: self.pending_reads.pop(k) for k in [k for k in self.pending_reads if k[0] == username]}
+        if not batch:
+            return
+
+        # read_count = 현재 message_count - (last_read_id 이후 메시지 수)
+        # 뒤쪽 꼬리만 (room_id, id) 인덱스로 세므로 전체 COUNT(*)가 아님
+        members = RoomMember.__table__
+        tail = (
+            select(func.count())
+            .where(and_(ChatLog.room_id == bindparam("b_room"),
+                        ChatLog.id > bindparam("b_last"),
+                        ChatLog.kind != "dm"))
+            .scalar_subquery()
+        )
+        room_count = select(Room.message_count).where(Room.id == bindparam("b_room")).scalar_subquery()
+        stmt = (
+            update(members)
+            .where(and_(members.c.room_id == bindparam("b_room"),
+                        members.c.username == bindparam("b_user"),
+                        members.c.last_read_id < bindparam("b_last")))
+            .values(last_read_id=bindparam("b_last"), read_count=room_count - tail)
+        )
+        params = [{"b_user": u, "b_room": r, "b_last": last} for (u, r), last in batch.items()]
+        try:
+            async with get_db() as db:
+                await db.execute(stmt, params)
+            # unread 캐시는 다음 room_activity 때 DB의 새 read_count로 다시 채움
+            for key in batch:
+                self.read_counts.pop(key, None)
+                # 백그라운드 flush는 사용자 컨텍스트가 없으므로 직접 주 DB 고정
+                pin_primary(key[0])
+        except Exception:
+            # 실패한 포인터는 다음 주기에 다시 시도
+            for (u, r), last in batch.items():
+                self.mark_read(u, r, last)
+            raise
+
+    async def _read_flush_loop(self):
+        while True:
+            await asyncio.sleep(self.READ_FLUSH_INTERVAL)
+            try:
+                await self.flush_read_pointers()
+            except Exception as e:
+                print(f"[WARN] read pointer flush failed: {e}")
+
+    def start_background(self):
+        self._read_flush_task = asyncio.create_task(self._read_flush_loop())
+        if self.HEARTBEAT_INTERVAL > 0:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop_background(self):
+        if self._read_flush_task:
+            self._read_flush_task.cancel()
+            self._read_flush_task = None
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        await self.flush_read_pointers()
+
+    # ---------- 종료 drain ----------
+    def reconnect_hint(self) -> str:
+        # close 사유(123바이트 제한)에 담는 재접속 대기 시간, 클라이언트는 이만큼 기다렸다가 재접속
+        return json.dumps({"reconnect_after_ms": random.randint(0, int(self.RECONNECT_JITTER * 1000))})
+
+    async def drain(self, aborted=lambda: False):
+        """새 연결 거부 -> 밀린 읽음 포인터 기록 -> 연결을 무작위 순서로 나눠서 닫기
+        (닫힌 연결의 순서 있는 쓰기 op는 각 수신 루프의 dispatcher.close()가 끝까지 실행)
+        aborted()가 True가 되면 남은 wave를 건너뜀 (나머지 연결은 uvicorn이 한 번에 닫음)"""
+        self.draining = True
+        try:
+            await self.flush_read_pointers()
+        except Exception as e:
+            print(f"[WARN] read pointer flush failed: {e}")
+        sessions = self._iter_all_sessions()
+        random.shuffle(sessions)
+        waves = max(1, min(self.DRAIN_WAVES, len(sessions)))
+        print(f"[INFO] Draining {len(sessions)} connections in {waves} waves over {self.DRAIN_WINDOW}s")
+        for i in range(waves):
+            if aborted():
+                break
+            wave = sessions[i::waves]
+            await asyncio.gather(*(self._close_draining(s.ws) for s in wave))
+            ws_drained.inc(len(wave))
+            if i < waves - 1:
+                await asyncio.sleep(self.DRAIN_WINDOW / waves)
+
+    async def _close_draining(self, ws: WebSocket):
+        try:
+            async with asyncio.timeout(SEND_TIMEOUT):
+                await ws.close(code=status.WS_1012_SERVICE_RESTART, reason=self.reconnect_hint())
+        except Exception:
+            pass
 
     # ---------- 친구 관리 ----------
     async def follow(self, user: str, target: str) -> str:
         if user == target:
             return "SELF"
         
-        async with get_db() as db:
-            # 사용자 존재 확인
-            user_result = await db.execute(select(User).where(User.username == user))
-            target_result = await db.execute(select(User).where(User.username == target))
-            
-            if not user_result.scalar_one_or_none() or not target_result.scalar_one_or_none():
-                return "NOT_REGISTERED"
-            
-            # 이미 팔로우 중인지 확인
-            follow_result = await db.execute(
-                select(Follow).where(
-                    and_(Follow.follower_username == user, Follow.followee_username == target)
-                )
-            )
-            if follow_result.scalar_one_or_none():
-                return "ALREADY"
-            
-            # 팔로우 추가
-            new_follow = Follow(follower_username=user, followee_username=target)
-            db.add(new_follow)
-            await db.commit()
-            return "FOLLOWED"
+        # 존재/중복 확인 SELECT 없이 INSERT 한 번: 중복은 idx_follow_unique 충돌, 없는 사용자는 FK 위반
+        stmt = (
+            pg_insert(Follow)
+            .values(follower_username=user, followee_username=target, created_at=now_utc())
+            .on_conflict_do_nothing(index_elements=[Follow.follower_username, Follow.followee_username])
+            .returning(Follow.id)
+        )
+        try:
+            async with get_db() as db:
+                result = await db.execute(stmt)
+                inserted = result.scalar_one_or_none()
+        except IntegrityError:
+            return "NOT_REGISTERED"
+        return "FOLLOWED" if inserted else "ALREADY"
 
     async def unfollow(self, user: str, target: str) -> str:
         async with get_db() as db:
@@ -505,41 +1273,29 @@ class ConnectionManager:
                 ).returning(Follow.id)
             )
             deleted = result.scalar_one_or_none()
-            await db.commit()
-            
-            return "UNFOLLOWED" if deleted else "NOT_FOLLOWING"
+        return "UNFOLLOWED" if deleted else "NOT_FOLLOWING"
 
     async def list_following(self, user: str) -> List[str]:
-        async with get_db() as db:
-            result = await db.execute(
-                select(Follow.followee_username).where(Follow.follower_username == user)
-            )
+        async with get_db(read_only=True) as db:
+            result = await db.execute(queries.FOLLOWING, {"username": user})
             return sorted([row[0] for row in result.all()])
 
     async def list_followers(self, user: str) -> List[str]:
-        async with get_db() as db:
-            result = await db.execute(
-                select(Follow.follower_username).where(Follow.followee_username == user)
-            )
+        async with get_db(read_only=True) as db:
+            result = await db.execute(queries.FOLLOWERS, {"username": user})
             return sorted([row[0] for row in result.all()])
 
-    async def subscribe_presence_friends(self, observer: str, ws: WebSocket):
-        async with self.lock:
-            self.presence_friend_subs[observer].add(ws)
+    def subscribe_presence_friends(self, session: Session):
+        session.presence_sub = True
 
-    async def unsubscribe_presence_friends(self, observer: str, ws: WebSocket):
-        async with self.lock:
-            s = self.presence_friend_subs.get(observer)
-            if s and ws in s:
-                s.remove(ws)
-                if not s:
-                    self.presence_friend_subs.pop(observer, None)
+    def unsubscribe_presence_friends(self, session: Session):
+        session.presence_sub = False
 
     async def online_friends_snapshot(self, observer: str) -> List[dict]:
         followees = await self.list_following(observer)
         async with self.lock:
-            online_users = set(self.user_conns.keys())
-            conn_counts = {u: len(self.user_conns[u]) for u in online_users}
+            online_users = set(self.user_sessions.keys())
+            conn_counts = {u: len(self.user_sessions[u]) for u in online_users}
         
         result = []
         for u in followees:
@@ -555,13 +1311,10 @@ class ConnectionManager:
         result.sort(key=lambda x: x["name"].lower())
         return result
 
-    async def _presence_targets_for_followers(self, subject: str) -> List[WebSocket]:
+    async def _presence_targets_for_followers(self, subject: str) -> List[Session]:
         followers = await self.list_followers(subject)
         async with self.lock:
-            targets: List[WebSocket] = []
-            for obs in followers:
-                targets.extend(list(self.presence_friend_subs.get(obs, set())))
-        return targets
+            return [s for obs in followers for s in self.user_sessions.get(obs, ()) if s.presence_sub]
 
     async def broadcast_presence_change_to_followers(self, subject: str, status: Literal["online", "offline"]):
         nick = await self._get_nickname(subject)
@@ -571,33 +1324,301 @@ class ConnectionManager:
                        name=nick or subject,
                        status=status)
         targets = await self._presence_targets_for_followers(subject)
-        await _send_json_many(targets, payload)
+        await self.fanout.send(targets, payload)
 
     async def send_user(self, username: str, payload: dict | str):
         async with self.lock:
-            sockets = list(self.user_conns.get(username, []))
+            sessions = list(self.user_sessions.get(username, []))
         if isinstance(payload, str):
             payload = _evt("system", text=payload)
-        await _send_json_many(sockets, payload)
+        await _send_many(sessions, payload)
 
 
 manager = ConnectionManager()
 
+ws_reaped = metrics.Counter("klav_ws_reaped_total", "Connections evicted by the server", ("reason",))
+ws_drained = metrics.Counter("klav_ws_drained_total", "Connections closed by the shutdown drain")
+op_timeouts = metrics.Counter("klav_op_timeouts_total", "WebSocket ops that hit their deadline", ("op",))
+metrics.Gauge("klav_ws_connections", "Open WebSocket connections",
+              fn=lambda: sum(len(sessions) for sessions in manager.user_sessions.values()))
+metrics.Gauge("klav_ws_users_online", "Users with at least one connection", fn=lambda: len(manager.user_sessions))
+# readiness backlog: 아직 끝나지 않은 op + fan-out/전달 백그라운드 태스크
+health = HealthChecker(backlog=lambda: OpDispatcher.pending + len(manager._bg_tasks))
+
 # ----- FastAPI 수명주기 -----
 @app.on_event("startup")
 async def _on_startup():
-    await init_db()
-    print("[INFO] Database initialized")
+    if TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    # uvicorn은 startup이 끝난 뒤에 소켓을 열고, /readyz는 첫 검사(아래 health.start) 전까지 503
+    t0 = time.perf_counter()
+    version = await init_db()
+    warmed = await warm_pool(queries.WARMUP)
+    print(f"[INFO] Database initialized (schema v{version}, {warmed} connections warmed, "
+          f"{(time.perf_counter() - t0) * 1000:.0f}ms)")
+    manager.start_background()
+    monitor.start()
+    tracing.start()
+    health.start()
 
 @app.on_event("shutdown")
 async def _on_shutdown():
+    await health.stop()
+    await monitor.stop()
+    await tracing.stop()
+    await manager.stop_background()
     await close_db()
     print("[INFO] Database connection closed")
 
 
 # ===== WebSocket =====
+# 같은 방에 대한 쓰기(와 방 밖의 상태 변경)는 들어온 순서대로, 나머지 조회는 동시에 처리
+_ROOM_ORDERED_OPS = {"msg", "room_dm", "join", "leave", "mark_read", "typing", "read_receipt", "room_focus", "room_blur"}
+_USER_ORDERED_OPS = {"create_room", "friend_follow", "friend_unfollow",
+                     "presence_friends_subscribe", "presence_friends_unsubscribe"}
+# 응답이 따로 없는 op: req_id를 보낸 경우에만 ack
+_ACK_OPS = {"join", "leave", "mark_read", "typing", "read_receipt", "room_focus", "room_blur",
+            "presence_friends_unsubscribe"}
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "8"))
+# op 하나의 DB 작업 제한 시간(초): 넘으면 진행 중인 쿼리를 취소하고 error TIMEOUT (fan-out은 제외)
+WS_OP_TIMEOUT = float(os.getenv("WS_OP_TIMEOUT", "5.0"))
+# 여러 방을 한 번에 읽는 op는 더 길게
+WS_SLOW_OP_TIMEOUT = float(os.getenv("WS_SLOW_OP_TIMEOUT", "15.0"))
+_SLOW_OPS = {"initial_sync", "resume", "search"}
+
+def _order_key(op) -> str | None:
+    typ = op_type(op)
+    if typ == "join" and not op.room_id and op.room:
+        # 이름으로 join: 실행해야 방 id를 알 수 있으므로 뒤에 오는 방별 op(그 방 id로 보낸 msg 등)와도 순서를 맞춤
+        return BARRIER
+    if typ in _ROOM_ORDERED_OPS:
+        return "room:" + (op.rid or "")
+    if typ in _USER_ORDERED_OPS:
+        return "user"
+    return None
+
+async def _reply(session: Session, op, payload: dict):
+    # 요청에 req_id가 있으면 응답에 그대로 돌려줌 (동시 처리로 응답 순서가 바뀔 수 있음)
+    if op.req_id is not None:
+        payload["req_id"] = op.req_id
+    with tracing.span("reply", type=payload.get("type")):
+        await session.send(payload)
+
+async def _run_op(session: Session, op):
+    typ = op_type(op)
+    try:
+        with deadline(WS_SLOW_OP_TIMEOUT if typ in _SLOW_OPS else WS_OP_TIMEOUT), \
+                tracing.start_op(typ, user=session.username, req_id=op.req_id):
+            await timed(_handle_op(session, op), typ)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        if is_timeout(e):
+            print(f"[WARN] {typ} timed out for {session.username}")
+            op_timeouts.inc(op=typ)
+            code = "TIMEOUT"
+        else:
+            print(f"[ERROR] {typ} failed for {session.username}: {e!r}")
+            code = "INTERNAL"
+        try:
+            await _reply(session, op, _evt("error", code=code))
+        except WebSocketDisconnect:
+            pass
+
+async def _handle_op(session: Session, op):
+    username = session.username
+    typ = op_type(op)
+
+    if typ == "create_room":
+        name = op.name.strip()
+        if not name:
+            await _reply(session, op, _evt("create_room_ack", status="INVALID"))
+            return
+        info = await manager.create_room(name, creator=username)
+        await _reply(session, op, _evt("create_room_ack", status="CREATED",
+                                       room_id=info["id"], name=info["name"]))
+
+    elif typ == "join":
+        room_id = op.room_id
+        if room_id:
+            added = await manager.join_room_by_id(room_id, username)
+        else:
+            name = op.room
+            if not name:
+                await _reply(session, op, _evt("error", code="ROOM_ID_OR_NAME_REQUIRED"))
+                return
+            room_id = await manager.join_or_create_by_name(name, username)
+            added = True
+
+        if added:
+            payload = _evt("system", room=room_id, event="joined", user=username,
+                           user_nickname=session.nickname)
+            await manager.broadcast_room(room_id, payload)
+
+    elif typ == "leave":
+        room_id = op.rid
+        if not room_id:
+            await _reply(session, op, _evt("error", code="ROOM_ID_REQUIRED"))
+            return
+        await manager.leave_room_by_id(room_id, username)
+        payload = _evt("system", room=room_id, event="left", user=username, user_nickname=session.nickname)
+        await manager.broadcast_room(room_id, payload)
+
+    elif typ == "msg":
+        room_id = op.rid
+        text = op.text
+        if not room_id:
+            await _reply(session, op, _evt("error", code="ROOM_ID_REQUIRED"))
+            return
+        entry = await manager.broadcast_room_message(room_id, username, text, from_nickname=session.nickname)
+        if op.req_id is not None:
+            await _reply(session, op, _evt("ack", op=typ, id=entry["id"], seq=entry["seq"]))
+
+    elif typ == "room_dm":
+        room_id = op.rid
+        to_user = op.to
+        text = op.text
+        if not room_id or not to_user:
+            await _reply(session, op, _evt("error", code="ROOM_ID_AND_TO_REQUIRED"))
+            return
+        status_ = await manager.dm_in_room(room_id, username, to_user, text, from_nickname=session.nickname)
+        await _reply(session, op, _evt("dm_ack", room=room_id, to=to_user, status=status_))
+
+    elif typ == "my_rooms":
+        summaries = await manager.rooms_summary(username)
+        await _reply(session, op, _evt("my_rooms",
+                                       rooms=[it["id"] for it in summaries],
+                                       rooms_info=summaries))
+
+    elif typ == "mark_read":
+        room_id = op.rid
+        last_read_id = op.last_read_id
+        if not room_id or last_read_id is None:
+            await _reply(session, op, _evt("error", code="ROOM_ID_AND_LAST_READ_ID_REQUIRED"))
+            return
+        # 멤버가 아닌 방의 포인터가 pending_reads에 쌓이지 않게 (typing/read_receipt와 같은 메모리 확인)
+        if not manager.in_room(username, room_id):
+            await _reply(session, op, _evt("error", code="NOT_IN_ROOM"))
+            return
+        manager.mark_read(username, room_id, last_read_id)
+
+    elif typ in ("typing", "read_receipt"):
+        room_id = op.rid
+        if not room_id or not manager.in_room(username, room_id):
+            await _reply(session, op, _evt("error", code="NOT_IN_ROOM"))
+            return
+        if typ == "typing":
+            payload = _evt("typing", room=room_id, user=username, active=op.active)
+        else:
+            payload = _evt("read_receipt", room=room_id, user=username, last_read_id=op.last_read_id)
+        manager.publish_ephemeral(username, room_id, typ, payload)
+
+    elif typ in ("room_focus", "room_blur"):
+        room_id = op.rid
+        if not room_id:
+            await _reply(session, op, _evt("error", code="ROOM_ID_REQUIRED"))
+            return
+        if typ == "room_focus" and not manager.in_room(username, room_id):
+            await _reply(session, op, _evt("error", code="NOT_IN_ROOM"))
+            return
+        manager.set_focus(session, room_id, typ == "room_focus")
+
+    elif typ == "initial_sync":
+        rooms = await manager.initial_sync(username, limit=op.limit, since=op.since)
+        await _reply(session, op, _evt("initial_sync", rooms=rooms))
+
+    elif typ == "resume":
+        rooms = await manager.resume(username, op.rooms)
+        await _reply(session, op, _evt("resume", rooms=rooms))
+
+    elif typ == "history":
+        room_id = op.rid
+        limit = op.limit
+        before = op.before
+        after = op.after
+        items = await manager.get_history(room_id, limit=limit, before=before, after=after)
+        await _reply(session, op, {"type": "history", "room": room_id, "items": items})
+
+    elif typ == "search":
+        q = op.q.strip()
+        if len(q) < manager.SEARCH_MIN_LEN:
+            await _reply(session, op, _evt("error", code="QUERY_TOO_SHORT"))
+            return
+        try:
+            items, next_cursor = await manager.search_messages(
+                username, q,
+                room_id=op.rid,
+                limit=op.limit,
+                cursor=op.cursor
+            )
+        except (ValueError, TypeError):
+            await _reply(session, op, _evt("error", code="INVALID_CURSOR"))
+            return
+        await _reply(session, op, _evt("search", q=q, items=items, next=next_cursor,
+                                       recent_only=len(q) < manager.SEARCH_TRGM_MIN_LEN))
+
+    elif typ == "friend_follow":
+        target = op.to
+        if not target:
+            await _reply(session, op, _evt("error", code="FOLLOW_TO_REQUIRED"))
+            return
+        status_ = await manager.follow(username, target)
+        await _reply(session, op, _evt("friend_follow_ack", to=target, status=status_))
+        if status_ == "FOLLOWED":
+            await manager.send_user(target, _evt("notify_followed", **{"from": username}))
+
+    elif typ == "friend_unfollow":
+        target = op.to
+        if not target:
+            await _reply(session, op, _evt("error", code="UNFOLLOW_TO_REQUIRED"))
+            return
+        status_ = await manager.unfollow(username, target)
+        await _reply(session, op, _evt("friend_unfollow_ack", to=target, status=status_))
+
+    elif typ == "following_list":
+        lst = await manager.list_following(username)
+        user_infos = []
+        for uname in lst:
+            nickname = await manager._get_nickname(uname)
+            user_infos.append({
+                "username": uname,
+                "nickname": nickname
+            })
+        await _reply(session, op, _evt("following_list", following=user_infos))
+
+    elif typ == "followers_list":
+        lst = await manager.list_followers(username)
+        user_infos = []
+        for uname in lst:
+            nickname = await manager._get_nickname(uname)
+            user_infos.append({
+                "username": uname,
+                "nickname": nickname
+            })
+        await _reply(session, op, _evt("followers_list", followers=user_infos))
+
+    elif typ == "get_online_friends":
+        users = await manager.online_friends_snapshot(username)
+        await _reply(session, op, _evt("online_friends", users=users))
+
+    elif typ == "presence_friends_subscribe":
+        manager.subscribe_presence_friends(session)
+        users = await manager.online_friends_snapshot(username)
+        await _reply(session, op, _evt("online_friends", users=users))
+
+    elif typ == "presence_friends_unsubscribe":
+        manager.unsubscribe_presence_friends(session)
+
+    if typ in _ACK_OPS and op.req_id is not None:
+        await _reply(session, op, _evt("ack", op=typ))
+
 @app.websocket("/ws")
 async def ws_endpoint(websocket: WebSocket):
+    if manager.draining:
+        # 종료 중: 수락 후 바로 닫아야 클라이언트가 close 사유(재접속 대기 시간)를 받음
+        await websocket.accept()
+        await websocket.close(code=status.WS_1012_SERVICE_RESTART, reason=manager.reconnect_hint())
+        return
     token = extract_token(websocket)
     if not token:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -608,151 +1629,65 @@ async def ws_endpoint(websocket: WebSocket):
     except HTTPException:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
+    # 이 연결의 op 태스크는 모두 이 값을 물려받음 (read-your-writes 기준 사용자)
+    current_user.set(username)
     
+    codec, subprotocol = negotiate(websocket.scope.get("subprotocols") or [])
+    batch_window = parse_batch_window(websocket.query_params.get("batch"))
     was_online = await manager.is_online(username)
-    await manager.accept(username, websocket)
+    session = await manager.accept(username, websocket, codec, subprotocol, batch_window=batch_window)
     await manager.flush_offline(username)
 
     if not was_online:
         await manager.broadcast_presence_change_to_followers(username, "online")
 
+    dispatcher = OpDispatcher(partial(_run_op, session), limit=WS_MAX_INFLIGHT)
     try:
         while True:
-            data = await websocket.receive_json()
-            typ = data.get("type")
-
-            if typ == "create_room":
-                name = (data.get("name") or "").strip()
-                if not name:
-                    await websocket.send_json(_evt("create_room_ack", status="INVALID"))
-                    continue
-                info = await manager.create_room(name, creator=username)
-                await websocket.send_json(_evt("create_room_ack", status="CREATED",
-                                               room_id=info["id"], name=info["name"]))
-            
-            elif typ == "join":
-                room_id = data.get("room_id")
-                if room_id:
-                    added = await manager.join_room_by_id(room_id, username)
-                else:
-                    name = data.get("room")
-                    if not name:
-                        await websocket.send_json(_evt("error", code="ROOM_ID_OR_NAME_REQUIRED"))
-                        continue
-                    room_id = await manager.join_or_create_by_name(name, username)
-                    added = True
-                
-                if added:
-                    nickname = await manager._get_nickname(username)
-                    targets = await manager._targets_in_room(room_id)
-                    payload = _evt("system", room=room_id, event="joined", user=username, user_nickname=nickname)
-                    await _send_json_many(targets, payload)
-            
-            elif typ == "leave":
-                room_id = data.get("room_id") or data.get("room")
-                if not room_id:
-                    await websocket.send_json(_evt("error", code="ROOM_ID_REQUIRED"))
-                    continue
-                nickname = await manager._get_nickname(username)
-                await manager.leave_room_by_id(room_id, username)
-                targets = await manager._targets_in_room(room_id)
-                payload = _evt("system", room=room_id, event="left", user=username, user_nickname=nickname)
-                await _send_json_many(targets, payload)
-
-            elif typ == "msg":
-                room_id = data.get("room_id") or data.get("room")
-                text = data.get("text", "")
-                if not room_id:
-                    await websocket.send_json(_evt("error", code="ROOM_ID_REQUIRED"))
-                    continue
-                nickname = await manager._get_nickname(username)
-                await manager.broadcast_room_message(room_id, username, text, from_nickname=nickname)
-
-            elif typ == "room_dm":
-                room_id = data.get("room_id") or data.get("room")
-                to_user = data.get("to")
-                text = data.get("text", "")
-                if not room_id or not to_user:
-                    await websocket.send_json(_evt("error", code="ROOM_ID_AND_TO_REQUIRED"))
-                    continue
-                nickname = await manager._get_nickname(username)
-                status_ = await manager.dm_in_room(room_id, username, to_user, text, from_nickname=nickname)
-                await websocket.send_json(_evt("dm_ack", room=room_id, to=to_user, status=status_))
-            
-            elif typ == "my_rooms":
-                summaries = await manager.rooms_summary(username)
-                await websocket.send_json(_evt("my_rooms",
-                                               rooms=[it["id"] for it in summaries],
-                                               rooms_info=summaries))
-            
-            elif typ == "history":
-                room_id = data.get("room_id") or data.get("room")
-                limit = int(data.get("limit", 20))
-                before = data.get("before")
-                after = data.get("after")
-                items = await manager.get_history(room_id, limit=limit, before=before, after=after)
-                await websocket.send_json({"type": "history", "room": room_id, "items": items})
-
-            elif typ == "friend_follow":
-                target = data.get("to")
-                if not target:
-                    await websocket.send_json(_evt("error", code="FOLLOW_TO_REQUIRED"))
-                    continue
-                status_ = await manager.follow(username, target)
-                await websocket.send_json(_evt("friend_follow_ack", to=target, status=status_))
-                if status_ == "FOLLOWED":
-                    await manager.send_user(target, _evt("notify_followed", **{"from": username}))
-
-            elif typ == "friend_unfollow":
-                target = data.get("to")
-                if not target:
-                    await websocket.send_json(_evt("error", code="UNFOLLOW_TO_REQUIRED"))
-                    continue
-                status_ = await manager.unfollow(username, target)
-                await websocket.send_json(_evt("friend_unfollow_ack", to=target, status=status_))
-
-            elif typ == "following_list":
-                lst = await manager.list_following(username)
-                user_infos = []
-                for uname in lst:
-                    nickname = await manager._get_nickname(uname)
-                    user_infos.append({
-                        "username": uname,
-                        "nickname": nickname
-                    })
-                await websocket.send_json(_evt("following_list", following=user_infos))
-
-            elif typ == "followers_list":
-                lst = await manager.list_followers(username)
-                user_infos = []
-                for uname in lst:
-                    nickname = await manager._get_nickname(uname)
-                    user_infos.append({
-                        "username": uname,
-                        "nickname": nickname
-                    })
-                await websocket.send_json(_evt("followers_list", followers=user_infos))
-
-            elif typ == "get_online_friends":
-                users = await manager.online_friends_snapshot(username)
-                await websocket.send_json(_evt("online_friends", users=users))
-
-            elif typ == "presence_friends_subscribe":
-                await manager.subscribe_presence_friends(username, websocket)
-                users = await manager.online_friends_snapshot(username)
-                await websocket.send_json(_evt("online_friends", users=users))
-
-            elif typ == "presence_friends_unsubscribe":
-                await manager.unsubscribe_presence_friends(username, websocket)
-
+            try:
+                raw = await _receive_raw(websocket)
+                session.touch()
+                op = codec.decode(raw)
+            except DecodeError as e:
+                await _send(websocket, _evt("error", code="BAD_REQUEST", detail=str(e)))
+                continue
+            if op_type(op) == "pong":
+                continue  # heartbeat 응답 (수신 시각은 위에서 갱신)
+            await dispatcher.submit(op, _order_key(op))
     except WebSocketDisconnect:
         pass
     finally:
-        await manager.remove(username, websocket)
-        await manager.unsubscribe_presence_friends(username, websocket)
+        await manager.remove(session)
+        await dispatcher.close()
         is_still_online = await manager.is_online(username)
         if not is_still_online:
             await manager.broadcast_presence_change_to_followers(username, "offline")
 
+class DrainingServer(uvicorn.Server):
+    """uvicorn은 종료 시 모든 WebSocket을 한 번에 끊고(1012) 나서 lifespan shutdown을 보내므로
+    그 전에 리스닝 소켓만 닫고 manager.drain()으로 연결을 나눠서 정리"""
+
+    async def shutdown(self, sockets=None):
+        if not self.force_exit:
+            # 리스닝 소켓을 닫기 전에 표시 -> 유예 시간 동안 들어온 /readyz는 503, /ws는 1012 + 재접속 힌트
+            health.draining = True
+            manager.draining = True
+            loop = asyncio.get_running_loop()
+            until = loop.time() + manager.DRAIN_UNREADY_GRACE
+            while not self.force_exit and loop.time() < until:
+                await asyncio.sleep(0.1)
+        for server in self.servers:
+            server.close()
+        if not self.force_exit:
+            await manager.drain(aborted=lambda: self.force_exit)
+        await super().shutdown(sockets)
+
 if __name__ == "__main__":
-    uvicorn.run("serverPostgres:app", host="0.0.0.0", port=5000, reload=True)
+    options = dict(host="0.0.0.0", port=5000,
+                   ws=CompressedWebSocketProtocol, ws_per_message_deflate=WS_DEFLATE,
+                   ws_ping_interval=WS_PING_INTERVAL, ws_ping_timeout=WS_PING_TIMEOUT)
+    if os.getenv("UVICORN_RELOAD", "0") == "1":
+        # 개발용 자동 재시작 (reloader가 워커 프로세스를 관리하므로 drain 없음)
+        uvicorn.run("serverPostgres:app", reload=True, **options)
+    else:
+        DrainingServer(uvicorn.Config(app, **options)).run()
@@ -0,0 +1,54 @@
+"""
+WebSocket 연결 하나의 상태
+
+ws.state 속성과 매니저의 연결별 dict/set에 흩어져 있던 값을 __slots__ 객체 하나로 모음.
+- username / nickname : 접속 시 한 번 조회한 닉네임을 메시지마다 재사용
+- rooms               : 같은 사용자의 모든 세션이 공유하는 방 집합 (ConnectionManager.user_rooms와 같은 객체)
+- focus               : room_focus 중인 방 (None이면 focus 미사용 -> 모든 방의 메시지를 받음)
+- presence_sub        : 친구 presence 구독 여부
+- batcher             : ?batch= 연결의 송신 배처
+- last_seen / received / sent : heartbeat와 통계용
+"""
+
+import time
+from typing import Set
+from fastapi import WebSocket
+
+from protocol import Codec
+from serverHelper import _write_frame
+
+
+class Session:
+    __slots__ = ("ws", "username", "nickname", "codec", "rooms", "focus", "presence_sub",
+                 "batcher", "last_seen", "received", "sent")
+
+    def __init__(self, ws: WebSocket, username: str, nickname: str, codec: Codec, rooms: Set[str]):
+        self.ws = ws
+        self.username = username
+        self.nickname = nickname
+        self.codec = codec
+        self.rooms = rooms
+        self.focus: Set[str] | None = None
+        self.presence_sub = False
+        self.batcher = None
+        self.last_seen = time.monotonic()
+        self.received = 0
+        self.sent = 0
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+        self.received += 1
+
+    def is_focused(self, room_id: str) -> bool:
+        return self.focus is None or room_id in self.focus
+
+    async def send_frame(self, frame: bytes):
+        self.sent += 1
+        if self.batcher is not None:
+            # ?batch= 로 연결한 소켓은 모아서 batch 프레임으로 전송
+            self.batcher.push(frame)
+            return
+        await _write_frame(self.ws, self.codec, frame)
+
+    async def send(self, payload: dict):
+        await self.send_frame(self.codec.encode(payload))
@@ -0,0 +1,282 @@
+"""
+장시간 soak 테스트: 접속/해제, DM, presence 구독, 팔로우를 계속 섞어 돌리면서
+서버의 메모리와 ConnectionManager 구조 크기가 살아 있는 연결 수로 설명되는지 확인
+
+사용법:
+    ADMIN_USERS=soak_admin TRACEMALLOC_FRAMES=1 python serverPostgres.py     # 로컬 서버
+    python soak_test.py --duration 600                                        # 10분 스모크
+    python soak_test.py --duration 14400 --users 300 --sample-interval 60 --out soak.jsonl
+
+동작:
+    - soak_admin / soak_u0.. 사용자를 등록하고 --rooms 개 방을 만들어 모두 가입시킴
+    - 사용자마다 루프: 로그인 -> 접속 -> 일정 시간 동안 임의로 msg / room_dm / typing / room_focus·blur /
+      presence 구독·해지 / 팔로우·언팔로우 -> 접속 해제 -> 잠시 쉼
+      (접속하지 않은 상대에게 보낸 DM은 offline_dm 큐에 쌓였다가 상대가 접속하면 전달됨)
+    - --sample-interval 마다 /debug/memory 를 조회해 구조 크기가 현재 연결 수로 설명되는지 검사
+    - --warmup 뒤와 끝에 모든 연결을 닫고 --settle 초 기다린 상태(quiesce)에서 측정:
+      연결별 구조(sessions, user_rooms, room_online, read_counts, 전송 창 ...)는 0이어야 하고,
+      두 quiesce 지점 사이의 RSS / tracemalloc 증가가 --max-growth-mb 이하여야 함
+    - 하나라도 어기면 종료 코드 1 (샘플은 --out 에 JSONL로 저장)
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import websockets
+
+ADMIN = "soak_admin"
+PASSWORD = "soak-pw"
+OFFLINE_DM_MAX = 100  # ConnectionManager.OFFLINE_DM_MAX
+
+# quiesce 상태(연결 0)에서 0이어야 하는 구조
+PER_CONNECTION = ("users_online", "sessions", "presence_subs", "user_rooms", "user_room_entries",
+                  "room_online", "room_counts", "read_counts", "ephemeral_windows", "activity_windows",
+                  "pending_reads", "bg_tasks", "inflight_ops")
+
+
+class Soak:
+    def __init__(self, args):
+        self.args = args
+        self.base = args.url.rstrip("/")
+        self.ws_url = self.base.replace("http", "ws", 1) + "/ws"
+        self.users = [f"soak_u{i}" for i in range(args.users)]
+        self.rooms: list[str] = []
+        self.open = 0
+        self.ops = 0
+        self.errors = 0
+        self.failures: list[str] = []
+        self.samples: list[dict] = []
+        self.admin_token = ""
+
+    # ---------- HTTP ----------
+    def _http(self, method: str, path: str, body: dict | None = None, token: str = "") -> dict:
+        req = urllib.request.Request(self.base + path, method=method,
+                                     data=json.dumps(body).encode() if body is not None else None)
+        req.add_header("Content-Type", "application/json")
+        if token:
+            req.add_header("Authorization", "Bearer " + token)
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            return json.loads(resp.read())
+
+    async def login(self, username: str) -> str:
+        body = {"username": username, "password": PASSWORD}
+        return (await asyncio.to_thread(self._http, "POST", "/login", body))["access_token"]
+
+    async def memory(self, mark: bool = False) -> dict:
+        # tracemalloc 증가분 기준은 quiesce 지점에서만 옮김 (final의 growth = baseline 대비)
+        path = f"/debug/memory?collect=true&top=10&mark={'true' if mark else 'false'}"
+        return await asyncio.to_thread(self._http, "GET", path, None, self.admin_token)
+
+    # ---------- 준비 ----------
+    async def setup(self):
+        for u in [ADMIN] + self.users:
+            await asyncio.to_thread(self._http, "POST", "/register",
+                                    {"username": u, "password": PASSWORD, "nickname": u})
+        self.admin_token = await self.login(ADMIN)
+        await self.memory()  # ADMIN_USERS 확인 (403이면 여기서 실패)
+        async with await self.connect(ADMIN) as ws:
+            for i in range(self.args.rooms):
+                await ws.send(json.dumps({"type": "create_room", "name": f"soak_room_{i}", "req_id": i}))
+                while True:
+                    m = json.loads(await ws.recv())
+                    if m.get("type") == "create_room_ack" and m.get("req_id") == i:
+                        self.rooms.append(m["room_id"])
+                        break
+
+        async def join_all(u: str):
+            async with await self.connect(u) as ws:
+                for r in self.rooms:
+                    await ws.send(json.dumps({"type": "join", "room_id": r, "req_id": r}))
+                acked = 0
+                while acked < len(self.rooms):
+                    if json.loads(await ws.recv()).get("type") == "ack":
+                        acked += 1
+
+        for i in range(0, len(self.users), 20):
+            await asyncio.gather(*(join_all(u) for u in self.users[i:i + 20]))
+        print(f"🌱 {len(self.users)} users, {len(self.rooms)} rooms")
+
+    async def connect(self, username: str):
+        token = await self.login(username)
+        return websockets.connect(self.ws_url, extra_headers={"Authorization": "Bearer " + token},
+                                  max_size=None)
+
+    # ---------- 부하 ----------
+    def random_op(self, me: str) -> dict:
+        room = random.choice(self.rooms)
+        other = random.choice(self.users)
+        kind = random.choices(
+            ["msg", "room_dm", "typing", "focus", "presence", "follow"],
+            weights=[30, 25, 15, 10, 10, 10],
+        )[0]
+        if kind == "msg":
+            return {"type": "msg", "room_id": room, "text": f"soak {self.ops}"}
+        if kind == "room_dm":
+            return {"type": "room_dm", "room_id": room, "to": other, "text": f"dm {self.ops}"}
+        if kind == "typing":
+            return {"type": "typing", "room_id": room, "active": random.random() < 0.7}
+        if kind == "focus":
+            return {"type": random.choice(["room_focus", "room_blur"]), "room_id": room}
+        if kind == "presence":
+            return {"type": random.choice(["presence_friends_subscribe", "presence_friends_unsubscribe"])}
+        return {"type": random.choice(["friend_follow", "friend_unfollow"]), "to": other}
+
+    async def user_loop(self, me: str, stop: asyncio.Event):
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            try:
+                async with await self.connect(me) as ws:
+                    self.open += 1
+                    reader = asyncio.create_task(self._discard(ws))
+                    try:
+                        until = loop.time() + random.uniform(*self.args.lifetime)
+                        while not stop.is_set() and loop.time() < until:
+                            await ws.send(json.dumps(self.random_op(me)))
+                            self.ops += 1
+                            await _wait(stop, random.expovariate(self.args.rate))
+                    finally:
+                        self.open -= 1
+                        reader.cancel()
+            except (OSError, websockets.WebSocketException, urllib.error.URLError) as e:
+                self.errors += 1
+                if self.errors <= 5:
+                    print(f"[WARN] {me}: {e!r}")
+            await _wait(stop, random.uniform(*self.args.offline))
+
+    @staticmethod
+    async def _discard(ws):
+        async for _ in ws:
+            pass
+
+    async def run_phase(self, seconds: float, label: str):
+        stop = asyncio.Event()
+        workers = [asyncio.create_task(self.user_loop(u, stop)) for u in self.users]
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            await asyncio.sleep(min(self.args.sample_interval, max(0.0, end - time.monotonic())))
+            if time.monotonic() < end:
+                self.check_live(await self.sample(label))
+        stop.set()
+        await asyncio.gather(*workers)
+
+    # ---------- 측정 / 검사 ----------
+    async def sample(self, label: str, mark: bool = False) -> dict:
+        mem = await self.memory(mark)
+        s = {"t": round(time.time()), "phase": label, "client_open": self.open, "ops": self.ops,
+             "errors": self.errors, "rss_bytes": mem.get("rss_bytes"), "registries": mem["registries"]}
+        if "tracemalloc" in mem:
+            s["traced_bytes"] = mem["tracemalloc"]["current_bytes"]
+            s["growth"] = mem["tracemalloc"]["growth"][:5]
+        self.samples.append(s)
+        r = s["registries"]
+        print(f"[{label}] open={self.open} sessions={r['sessions']} rss={_mb(s['rss_bytes'])} "
+              f"traced={_mb(s.get('traced_bytes'))} offline_dm={r['offline_dm_users']} "
+              f"room_online={r['room_online']} ops={self.ops} errors={self.errors}")
+        return s
+
+    def fail(self, msg: str):
+        print(f"❌ {msg}")
+        self.failures.append(msg)
+
+    def check_live(self, s: dict):
+        r = s["registries"]
+        users, rooms = len(self.users) + 1, len(self.rooms)
+        # 접속/해제가 진행 중인 연결만큼 차이가 날 수 있음
+        slack = max(5, users // 10)
+        bounds = {
+            "sessions": s["client_open"] + slack,
+            "users_online": users,
+            "user_rooms": r["users_online"],
+            "presence_subs": r["sessions"],
+            "room_online": r["user_room_entries"],
+            "room_counts": r["room_online"],
+            "read_counts": r["user_room_entries"],
+            "ephemeral_windows": r["users_online"] * rooms * 2,
+            "activity_windows": rooms,
+            "offline_dm_users": users,
+            "offline_dm_messages": users * OFFLINE_DM_MAX,
+            "primary_pins": users,
+        }
+        for name, bound in bounds.items():
+            if r.get(name, 0) > bound:
+                self.fail(f"{s['phase']}: {name}={r[name]} > {bound} (open={s['client_open']})")
+
+    def check_quiet(self, s: dict):
+        r = s["registries"]
+        for name in PER_CONNECTION:
+            if r.get(name, 0):
+                self.fail(f"{s['phase']}: {name}={r[name]} with no open connections")
+        if r["offline_dm_users"] > len(self.users) + 1:
+            self.fail(f"{s['phase']}: offline_dm_users={r['offline_dm_users']} > users")
+
+    async def quiesce(self, label: str) -> dict:
+        await asyncio.sleep(self.args.settle)
+        s = await self.sample(label, mark=True)
+        self.check_quiet(s)
+        return s
+
+    async def run(self) -> int:
+        await self.setup()
+        await self.run_phase(self.args.warmup, "warmup")
+        base = await self.quiesce("baseline")
+        await self.run_phase(self.args.duration, "soak")
+        final = await self.quiesce("final")
+
+        limit = self.args.max_growth_mb * 1024 * 1024
+        for key in ("rss_bytes", "traced_bytes"):
+            if base.get(key) is not None and final.get(key) is not None:
+                grown = final[key] - base[key]
+                print(f"   {key}: {_mb(base[key])} -> {_mb(final[key])} ({grown / 1048576:+.1f}MB)")
+                if grown > limit:
+                    self.fail(f"{key} grew {grown / 1048576:.1f}MB > {self.args.max_growth_mb}MB between quiesce points")
+        for g in final.get("growth", []):
+            print(f"   {g['size_diff_bytes'] / 1024:+10.1f}KB {g['count_diff']:+8d}  {g['where']}")
+
+        if self.args.out:
+            with open(self.args.out, "w", encoding="utf-8") as f:
+                for s in self.samples:
+                    f.write(json.dumps(s, ensure_ascii=False) + "\n")
+        if self.failures:
+            print(f"❌ {len(self.failures)} check(s) failed ({self.ops} ops, {self.errors} connection errors)")
+            return 1
+        print(f"✅ no unexplained growth ({self.ops} ops, {self.errors} connection errors)")
+        return 0
+
+
+async def _wait(event: asyncio.Event, seconds: float):
+    try:
+        await asyncio.wait_for(event.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+def _mb(v) -> str:
+    return "-" if v is None else f"{v / 1048576:.1f}MB"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=3600, help="본 측정 시간(초)")
+    parser.add_argument("--warmup", type=float, default=60, help="기준점 전 예열 시간(초)")
+    parser.add_argument("--settle", type=float, default=5, help="연결을 모두 닫은 뒤 측정까지 대기(초)")
+    parser.add_argument("--sample-interval", type=float, default=30)
+    parser.add_argument("--rate", type=float, default=1.0, help="연결당 초당 평균 op 수")
+    parser.add_argument("--lifetime", type=float, nargs=2, default=(5, 60), help="연결 유지 시간 범위(초)")
+    parser.add_argument("--offline", type=float, nargs=2, default=(1, 20), help="재접속 전 쉬는 시간 범위(초)")
+    parser.add_argument("--max-growth-mb", type=float, default=20)
+    parser.add_argument("--out", default="")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(Soak(args).run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+WebSocket op 단위 트레이싱 (샘플링된 op만 span을 만듦)
+
+- op 하나 = 트레이스 하나: 루트 span "op.<종류>" 아래에 함수 구간 span(append_log, fanout, reply ...)과
+  DB 문장마다 "db.<select|insert|update|...>" span (SQLAlchemy 엔진 이벤트, 문장은 TRACE_SQL_MAX자까지)
+- 현재 span은 ContextVar로 전달 (AsyncSession이 greenlet 안에서 실행하는 엔진 이벤트에서도 같은 값이 보임)
+- 샘플링: TRACE_SAMPLE_RATE 확률로 시작 (0이면 끔, 샘플링 안 된 op는 span 객체도 만들지 않음)
+  TRACE_OPS 로 op 종류 제한, TRACE_MIN_MS 보다 짧게 끝난 트레이스는 버림
+- 출력: 최근 TRACE_BUFFER개는 메모리 링 버퍼 (/debug/traces)
+  TRACE_FILE 이 있으면 JSONL로 추가, OTEL_EXPORTER_OTLP_ENDPOINT 가 있으면 OTLP/HTTP JSON으로 전송
+  (파일/OTLP는 백그라운드 태스크가 TRACE_EXPORT_INTERVAL마다 모아서 스레드에서 씀)
+
+사용:
+    with tracing.start_op("msg", user=username):   # 루트 (샘플링 여부 결정)
+        with tracing.span("append_log", room=room_id):
+            ...
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import urllib.request
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import List
+
+from sqlalchemy import event
+
+from metrics import Counter
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_OPS = {o.strip() for o in os.getenv("TRACE_OPS", "").split(",") if o.strip()}
+TRACE_MIN_MS = float(os.getenv("TRACE_MIN_MS", "0"))
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "200"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "2.0"))
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "").rstrip("/")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "klav-server")
+TRACE_SQL_MAX = 300
+TRACE_MAX_SPANS = 500  # 트레이스 하나에 남기는 최대 span 수 (resume 등 문장이 많은 op)
+EXPORT_QUEUE_MAX = 10000
+
+traces_total = Counter("klav_traces_total", "Finished sampled traces", ("result",))
+trace_export_errors = Counter("klav_trace_export_errors_total", "Failed trace exports", ("sink",))
+
+_current: ContextVar["Span | None"] = ContextVar("trace_span", default=None)
+
+recent: deque = deque(maxlen=TRACE_BUFFER)
+_export_queue: List[dict] = []
+_export_task: asyncio.Task | None = None
+
+
+class _Noop:
+    """샘플링되지 않았을 때 span 대신 쓰는 객체 (할당 없이 공유)"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _Noop()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "dropped", "done")
+
+    def __init__(self):
+        self.trace_id = random.getrandbits(128).to_bytes(16, "big").hex()
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self.done = False
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attrs", "error", "_token")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: str | None, attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = random.getrandbits(64).to_bytes(8, "big").hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attrs = attrs
+        self.error: str | None = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, asyncio.CancelledError):
+            self.error = repr(exc)
+        elif exc is not None:
+            self.error = "cancelled"
+        _current.reset(self._token)
+        self.end()
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        trace = self.trace
+        if trace.done:
+            return  # 루트가 끝난 뒤에 끝난 span (백그라운드 태스크 등)은 버림
+        if len(trace.spans) >= TRACE_MAX_SPANS:
+            trace.dropped += 1
+        else:
+            trace.spans.append(self)
+        if self.parent_id is None:
+            trace.done = True
+            _finish(self)
+
+
+def start_op(op: str, **attrs):
+    """op 루트 span (샘플링되지 않으면 아무것도 하지 않는 객체)"""
+    if TRACE_SAMPLE_RATE <= 0 or (TRACE_OPS and op not in TRACE_OPS) or random.random() >= TRACE_SAMPLE_RATE:
+        return _NOOP
+    return Span(_Trace(), "op." + op, None, attrs)
+
+
+def span(name: str, **attrs):
+    """현재 트레이스의 자식 span (트레이스 밖이면 아무것도 하지 않는 객체)"""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(parent.trace, name, parent.span_id, attrs)
+
+
+# ---------- DB 문장 span ----------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current.get()
+    if parent is None or context is None:
+        return
+    verb = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "sql"
+    context._trace_span = Span(parent.trace, "db." + verb, parent.span_id,
+                               {"db.statement": statement[:TRACE_SQL_MAX]})
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    s = getattr(context, "_trace_span", None)
+    if s is not None:
+        context._trace_span = None
+        s.end()
+
+
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    s = getattr(context, "_trace_span", None)
+    if s is not None:
+        context._trace_span = None
+        s.error = repr(exception_context.original_exception)
+        s.end()
+
+
+def instrument_engine(engine):
+    """AsyncEngine의 문장 실행마다 현재 트레이스에 db span 추가 (트레이스 밖이면 ContextVar 조회만)"""
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+
+# ---------- 출력 ----------
+def _finish(root: Span):
+    trace = root.trace
+    ms = (root.end_ns - root.start_ns) / 1e6
+    if ms < TRACE_MIN_MS:
+        traces_total.inc(result="below_min")
+        return
+    traces_total.inc(result="kept")
+    record = {
+        "trace_id": trace.trace_id,
+        "op": root.name,
+        "start": datetime.fromtimestamp(root.start_ns / 1e9, timezone.utc).isoformat(),
+        "ms": round(ms, 3),
+        "dropped_spans": trace.dropped,
+        "spans": [
+            {
+                "name": s.name,
+                "id": s.span_id,
+                "parent": s.parent_id,
+                "offset_ms": round((s.start_ns - root.start_ns) / 1e6, 3),
+                "ms": round((s.end_ns - s.start_ns) / 1e6, 3),
+                "attrs": s.attrs,
+                "error": s.error,
+                # OTLP 변환용 (JSON 출력에서는 뺌)
+                "_start_ns": s.start_ns,
+                "_end_ns": s.end_ns,
+            }
+            # 시작 순서로 (끝난 순서로 쌓여 있음)
+            for s in sorted(trace.spans, key=lambda s: s.start_ns)
+        ],
+    }
+    recent.append(record)
+    if (TRACE_FILE or OTLP_ENDPOINT) and len(_export_queue) < EXPORT_QUEUE_MAX:
+        _export_queue.append(record)
+
+
+def _public(record: dict) -> dict:
+    return dict(record, spans=[{k: v for k, v in s.items() if not k.startswith("_")} for s in record["spans"]])
+
+
+def snapshot(op: str | None = None, limit: int = 20) -> List[dict]:
+    """최근 트레이스 (최신순, /debug/traces)"""
+    out = []
+    for record in reversed(recent):
+        if op is None or record["op"] == "op." + op:
+            out.append(_public(record))
+            if len(out) >= limit:
+                break
+    return out
+
+
+def _otlp_value(v) -> dict:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+def _otlp_payload(records: List[dict]) -> dict:
+    spans = []
+    for record in records:
+        for s in record["spans"]:
+            attrs = [{"key": k, "value": _otlp_value(v)} for k, v in s["attrs"].items() if v is not None]
+            spans.append({
+                "traceId": record["trace_id"],
+                "spanId": s["id"],
+                "parentSpanId": s["parent"] or "",
+                "name": s["name"],
+                # 루트(op)는 SERVER, DB 문장은 CLIENT, 나머지는 INTERNAL
+                "kind": 2 if s["parent"] is None else 3 if s["name"].startswith("db.") else 1,
+                "startTimeUnixNano": str(s["_start_ns"]),
+                "endTimeUnixNano": str(s["_end_ns"]),
+                "attributes": attrs,
+                "status": {"code": 2, "message": s["error"]} if s["error"] else {},
+            })
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "klav"}, "spans": spans}],
+    }]}
+
+
+def _write_file(records: List[dict]):
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(_public(record), ensure_ascii=False) + "\n")
+
+
+def _post_otlp(records: List[dict]):
+    req = urllib.request.Request(
+        OTLP_ENDPOINT + "/v1/traces",
+        data=json.dumps(_otlp_payload(records)).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        resp.read()
+
+
+async def flush():
+    global _export_queue
+    if not _export_queue:
+        return
+    batch, _export_queue = _export_queue, []
+    for sink, write in (("file", _write_file if TRACE_FILE else None),
+                        ("otlp", _post_otlp if OTLP_ENDPOINT else None)):
+        if write is None:
+            continue
+        try:
+            await asyncio.to_thread(write, batch)
+        except Exception as e:
+            trace_export_errors.inc(sink=sink)
+            print(f"[WARN] trace export to {sink} failed: {e!r}")
+
+
+async def _export_loop():
+    while True:
+        await asyncio.sleep(TRACE_EXPORT_INTERVAL)
+        await flush()
+
+
+def start():
+    global _export_task
+    if TRACE_SAMPLE_RATE > 0 and (TRACE_FILE or OTLP_ENDPOINT):
+        _export_task = asyncio.create_task(_export_loop())
+
+
+async def stop():
+    global _export_task
+    if _export_task:
+        _export_task.cancel()
+        _export_task = None
+    await flush()
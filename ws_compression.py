@@ -0,0 +1,90 @@
+"""
+WebSocket permessage-deflate 설정
+
+uvicorn 기본값은 압축 설정을 바꿀 수 없고(윈도우 15비트, 모든 프레임 압축)
+소켓마다 압축 컨텍스트가 수백 KB씩 유지된다.
+여기서는 uvicorn websockets 프로토콜을 감싸서
+- WS_DEFLATE_MIN_SIZE 보다 작은 메시지는 압축하지 않고 (RSV1 없이 그대로 전송)
+- 윈도우 크기 / memLevel / context takeover를 환경변수로 제한해
+  소켓당 메모리를 일정하게 유지한다.
+
+사용: uvicorn.run(..., ws=CompressedWebSocketProtocol, ws_per_message_deflate=WS_DEFLATE)
+"""
+
+import os
+from websockets import frames
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+
+WS_DEFLATE = os.getenv("WS_DEFLATE", "1") == "1"
+# 이 크기(바이트) 미만 메시지는 압축하지 않음 (작은 프레임은 압축 이득보다 CPU가 큼)
+WS_DEFLATE_MIN_SIZE = int(os.getenv("WS_DEFLATE_MIN_SIZE", "1024"))
+# 압축 윈도우 (8~15). 소켓당 압축 메모리 ~= 2^(bits+2) + 2^(memLevel+9)
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "12"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5"))
+# 1이면 메시지마다 압축 컨텍스트를 버림 (압축률 ↓, 유휴 소켓 메모리 0)
+WS_DEFLATE_SERVER_NO_CONTEXT_TAKEOVER = os.getenv("WS_DEFLATE_SERVER_NO_CONTEXT_TAKEOVER", "0") == "1"
+WS_DEFLATE_CLIENT_NO_CONTEXT_TAKEOVER = os.getenv("WS_DEFLATE_CLIENT_NO_CONTEXT_TAKEOVER", "0") == "1"
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """min_size 미만 메시지는 압축 없이 보내는 permessage-deflate
+    (RFC 7692: 메시지별로 RSV1을 끄면 비압축 메시지로 처리됨)"""
+
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self._skip_message = False
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+        # 조각난 메시지는 첫 프레임 기준으로 메시지 전체를 같이 처리
+        if frame.opcode is not frames.OP_CONT:
+            self._skip_message = len(frame.data) < self.min_size
+        if self._skip_message:
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, *args, min_size: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, ext = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            ext.remote_no_context_takeover,
+            ext.local_no_context_takeover,
+            ext.remote_max_window_bits,
+            ext.local_max_window_bits,
+            ext.compress_settings,
+            min_size=self.min_size,
+        )
+
+
+def deflate_factory(
+    min_size: int = WS_DEFLATE_MIN_SIZE,
+    window_bits: int = WS_DEFLATE_WINDOW_BITS,
+    mem_level: int = WS_DEFLATE_MEM_LEVEL,
+    server_no_context_takeover: bool = WS_DEFLATE_SERVER_NO_CONTEXT_TAKEOVER,
+    client_no_context_takeover: bool = WS_DEFLATE_CLIENT_NO_CONTEXT_TAKEOVER,
+) -> ThresholdDeflateFactory:
+    return ThresholdDeflateFactory(
+        server_no_context_takeover=server_no_context_takeover,
+        client_no_context_takeover=client_no_context_takeover,
+        server_max_window_bits=window_bits,
+        client_max_window_bits=window_bits,
+        compress_settings={"memLevel": mem_level},
+        min_size=min_size,
+    )
+
+
+class CompressedWebSocketProtocol(WebSocketProtocol):
+    """uvicorn websockets 프로토콜 + 위 설정의 permessage-deflate"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.config.ws_per_message_deflate:
+            self.available_extensions = [deflate_factory()]